@@ -1,9 +1,52 @@
-from elasticsearch import Elasticsearch
+__author__ = 'alse'
 
-from search.indexer import Indexer
-from search.searcher import Searcher
+# the elasticsearch client or embedded index, indexer and searcher are only created on first use
+elastic_search = None
+indexer = None
+searcher = None
+embedded_index = None
 
-__author__ = 'alse'
-elastic_search = Elasticsearch()
-indexer = Indexer(elastic_search)
-searcher = Searcher(elastic_search)
+
+def get_elastic_search():
+    global elastic_search
+    if elastic_search is None:
+        from elasticsearch import Elasticsearch
+        elastic_search = Elasticsearch()
+    return elastic_search
+
+
+def get_embedded_index():
+    global embedded_index
+    if embedded_index is None:
+        from lib import utils
+        from search.embedded import EmbeddedIndex
+        embedded_index = EmbeddedIndex(utils.embedded_index_path)
+    return embedded_index
+
+
+def get_indexer():
+    global indexer
+    if indexer is None:
+        from lib import utils
+        if utils.search_backend == "embedded":
+            from search.embedded import EmbeddedIndexer
+            indexer = EmbeddedIndexer(get_embedded_index())
+        else:
+            from search.indexer import Indexer
+            indexer = Indexer(get_elastic_search(), get_searcher())
+    return indexer
+
+
+def get_searcher():
+    global searcher
+    if searcher is None:
+        from lib import utils
+        # the fields and profiles of the training documents are defined by the feature tests
+        from tests.integrated import get_source_fields, summary_map, get_type_profiles
+        if utils.search_backend == "embedded":
+            from search.embedded import EmbeddedSearcher
+            searcher = EmbeddedSearcher(get_embedded_index(), get_type_profiles)
+        else:
+            from search.searcher import Searcher
+            searcher = Searcher(get_elastic_search(), get_source_fields, list(summary_map), get_type_profiles)
+    return searcher
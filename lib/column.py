@@ -1,18 +1,28 @@
-import locale
-import re
+from array import array
 from collections import defaultdict
 import logging
+import sys
 
-from numpy import percentile, array
+from numpy import percentile
 from numpy.random import choice
 
-from lib.utils import split_number_text, not_allowed_chars, get_distribution
-from tests.integrated import get_test_results
+from lib import utils
+from lib.utils import normalize_values, split_number_text_batch, get_distribution
+from tests.integrated import get_test_results, get_column_fingerprints
+from tests.label import get_name_bigrams
+from tests.numeric import get_quartiles
+from tests.textual import get_minhash
 
 __author__ = 'alse'
 
 
 class Column:
+    # sources stay in memory for the whole life of the labeler, so columns have no instance dict,
+    # numbers and lengths are kept in typed arrays and strings are interned
+    __slots__ = ("source_name", "name", "value_list", "textual_list", "textual_set", "word_set", "semantic_type",
+                 "numeric_list", "numeric_count", "sample_list", "joined_text", "is_prepared", "word2vec",
+                 "word_lengths", "char_lengths", "histogram_list")
+
     def __init__(self, name, source_name=None):
         logging.debug("Initializing column: {}".format((name, source_name)))
         self.source_name = source_name
@@ -22,13 +32,14 @@ class Column:
         self.textual_set = set()
         self.word_set = set()
         self.semantic_type = None
-        self.numeric_list = []
+        self.numeric_list = array("d")
+        self.numeric_count = 0
         self.sample_list = []
-        self.value_text = ""
+        self.joined_text = None
         self.is_prepared = False
         self.word2vec = []
-        self.word_lengths = []
-        self.char_lengths = []
+        self.word_lengths = array("l")
+        self.char_lengths = array("l")
         self.histogram_list = []
 
     def __str__(self):
@@ -37,54 +48,49 @@ class Column:
     def __repr__(self):
         return self.__str__()
 
-    def add_value(self, value):
-        logging.debug("     starting element add")
-        if not value:
-            return
-
-        value = value.strip()
-        logging.debug("  adding value (" + str(value) + ") to column (" + str(self.name) + ") with type " + str(type(value)))
-        if not value or value == "NULL":
-            return
-        # String handling is different in Python3 from what it was in Python2
-        # All strings are by default unicode
-        value = value.encode("ascii", "ignore").decode()
-        # try:
-        #     value = value.encode("ascii", "ignore").decode()
-        #     logging.debug("  decoding: {}".format(type(value)))
-        # except:
-        #     value = value.decode("unicode_escape").encode("ascii", "ignore").decode("ascii", "ignore")
-        #     logging.debug("  decoding: {}".format(type(value)))
-
-        value = re.sub(not_allowed_chars, " ", value)
-        logging.debug("    1 subsitute not allowed chars: {}".format(value))
-
-        self.word_set = self.word_set.union(set(value.split(" ")))
-        logging.debug("    2 ...")
-
-        if self.source_name and "full" in self.source_name and len(self.value_list) > 500:
-            return
-        logging.debug("    2 ...")
-        self.value_list.append(value)
-        logging.debug("    2 ...")
+    @property
+    def value_text(self):
+        # the textual parts are joined on demand instead of keeping a second copy of them
+        if self.joined_text is not None:
+            return self.joined_text
+        return "".join([" " + text for text in self.textual_list])
 
-        self.word_lengths.append(len(value.split(" ")))
-        logging.debug("    2 ...")
-        self.char_lengths.append(len(value))
-        logging.debug("    2 ...")
+    @value_text.setter
+    def value_text(self, text):
+        self.joined_text = text
 
-        numbers, text = split_number_text(value)
-        logging.debug("    3 ...")
-
-        if text:
-            self.value_text += (" " + text)
+    def add_value(self, value):
+        self.add_values([value])
 
-            self.textual_set.add(text)
-            self.textual_list.append(text)
-        # logging.debug("    4 splitting")
-        if numbers:
-            self.numeric_list.append(max([locale.atof(v[0]) for v in numbers]))
-        # logging.debug("      value added.")
+    def add_values(self, values):
+        """
+        Add a batch of raw values to the column.
+        Values are normalized and split into numbers and text for the whole batch at once.
+        :param values: Iterable of raw values.
+        :return:
+        """
+        values = normalize_values(values)
+        if not values:
+            return
+        logging.debug("  adding %d values to column (%s)", len(values), self.name)
+
+        values = [sys.intern(value) for value in values]
+        self.word_set.update(" ".join(values).split(" "))
+
+        if self.source_name and "full" in self.source_name:
+            values = values[:max(0, 501 - len(self.value_list))]
+            if not values:
+                return
+        self.value_list.extend(values)
+        self.word_lengths.extend([value.count(" ") + 1 for value in values])
+        self.char_lengths.extend([len(value) for value in values])
+
+        texts, numbers = split_number_text_batch(values)
+        texts = [sys.intern(text) for text in texts if text]
+        self.textual_set.update(texts)
+        self.textual_list.extend(texts)
+        self.numeric_list.extend([number for _, number in numbers])
+        self.numeric_count = len(self.numeric_list)
 
     def prepare_data(self):
         self.word2vec = []
@@ -99,10 +105,10 @@ class Column:
         if not self.is_prepared:
             sample_size = min(200, len(self.numeric_list))
             # print self.value_list
-            if percentile(array(self.word_lengths), 25) != percentile(array(self.word_lengths), 75):
-                self.word_lengths = []
-            if percentile(array(self.char_lengths), 25) != percentile(array(self.char_lengths), 75):
-                self.char_lengths = []
+            if percentile(self.word_lengths, 25) != percentile(self.word_lengths, 75):
+                self.word_lengths = array("l")
+            if percentile(self.char_lengths, 25) != percentile(self.char_lengths, 75):
+                self.char_lengths = array("l")
 
             self.histogram_list = get_distribution(self.value_list)
             if len(self.histogram_list) > 20:
@@ -112,7 +118,7 @@ class Column:
             if self.numeric_list:
                 self.sample_list = choice(self.numeric_list, sample_size).tolist()
             else:
-                self.sample_list = self.numeric_list
+                self.sample_list = []
             self.is_prepared = True
 
     def to_json(self):
@@ -129,10 +135,19 @@ class Column:
                     'textual': self.value_text,
                     'is_numeric': self.is_numeric(),
                     'word2vec': self.word2vec,
-                    'numeric_list': self.numeric_list,
-                    'char_lengths': self.char_lengths,
-                    "word_lengths": self.word_lengths,
+                    'numeric_list': list(self.numeric_list),
+                    'sorted_numeric_list': sorted(self.numeric_list),
+                    'numeric_quartiles': get_quartiles(self.numeric_list),
+                    'name_bigrams': get_name_bigrams(self.name),
+                    'char_lengths': list(self.char_lengths),
+                    "word_lengths": list(self.word_lengths),
                     "histogram": self.histogram_list}
+        # the sketch is only read by the approximate JACCARD test, columns indexed without it get it when read
+        if utils.jaccard_error is not None:
+            doc_body['textual_minhash'] = get_minhash(self.textual_set)
+        # the feature cache is keyed by the fingerprints of the fields the feature tests read
+        if utils.feature_cache_size:
+            doc_body['fingerprints'] = get_column_fingerprints(doc_body)
         logging.info("Column to json succeeded: {}".format(self.name))
         return doc_body
 
@@ -148,6 +163,29 @@ class Column:
         self.sample_list = json_obj['sample_numeric']
         self.value_text = json_obj['textual']
 
+    def memory_usage(self):
+        """
+        Approximate memory held by the column.
+        Strings shared between the containers of the column are counted once.
+        :return: Map from attribute name to bytes, with the sum under "total".
+        """
+        seen = set()
+
+        def size_of(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            size = sys.getsizeof(obj)
+            if isinstance(obj, (list, set, tuple)):
+                size += sum([size_of(item) for item in obj])
+            return size
+
+        usage = {}
+        for attribute in self.__slots__:
+            usage[attribute] = size_of(getattr(self, attribute, None))
+        usage["total"] = sum(usage.values())
+        return usage
+
     def is_numeric(self):
         logging.debug("Column check for numeric: {}".format(self.name))
         return len(self.textual_list) * 1.0 / (len(self.textual_list) + len(self.numeric_list))
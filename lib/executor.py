@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import logging
+
+from lib import utils
+
+__author__ = 'minh'
+
+SERIAL_BACKEND = "serial"
+THREAD_BACKEND = "thread"
+PROCESS_BACKEND = "process"
+SPARK_BACKEND = "spark"
+
+pools = {}
+
+
+def get_pool(backend):
+    if backend not in pools:
+        logging.info("Starting {} pool with {} workers".format(backend, utils.execution_workers))
+        if backend == THREAD_BACKEND:
+            pools[backend] = ThreadPoolExecutor(max_workers=utils.execution_workers)
+        else:
+            pools[backend] = ProcessPoolExecutor(max_workers=utils.execution_workers)
+    return pools[backend]
+
+
+def map_values(func, items, backend=None):
+    """
+    Apply func to every item with the configured execution backend.
+    With the process and spark backends func has to be picklable,
+    i.e. a module level function or a functools.partial of one.
+    :param func: Function of one item.
+    :param items: List of items.
+    :param backend: One of serial, thread, process or spark. Defaults to utils.execution_backend.
+    :return: List of results in the order of items.
+    """
+    backend = backend or utils.execution_backend
+    if not items:
+        return []
+    if backend == SERIAL_BACKEND or len(items) == 1:
+        return [func(item) for item in items]
+    if backend == THREAD_BACKEND:
+        return list(get_pool(backend).map(func, items))
+    if backend == PROCESS_BACKEND:
+        chunk_size = max(1, len(items) // (4 * (utils.execution_workers or 4)))
+        return list(get_pool(backend).map(func, items, chunksize=chunk_size))
+    if backend == SPARK_BACKEND:
+        from main import get_spark_context
+        return get_spark_context().parallelize(items).map(func).collect()
+    raise ValueError("Unknown execution backend: {}".format(backend))
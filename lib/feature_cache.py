@@ -0,0 +1,164 @@
+from collections import OrderedDict, Counter
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+
+from lib import utils
+
+__author__ = 'minh'
+
+# bump when the results of the feature tests change without a change of their sources in the tests package,
+# e.g. with an upgrade of scipy, see get_code_version
+feature_cache_version = 2
+# fields listing a set in the iteration order of the set, which changes with the hash seed of every process
+set_fields = {"textual_set"}
+tests_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests")
+
+feature_cache = None
+code_version = None
+
+
+def get_fingerprints(item_map, fields):
+    """
+    Content fingerprints of fields of a column document, each the hash of the value of the field.
+    :param fields: Fields to fingerprint, those missing from the document are skipped.
+    :return: Map from field to fingerprint.
+    """
+    fingerprints = {}
+    for field in fields:
+        if field in item_map:
+            value = sorted(item_map[field]) if field in set_fields else item_map[field]
+            fingerprints[field] = hashlib.sha1(json.dumps(value).encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def merge_fingerprints(fingerprint1, fingerprint2):
+    """
+    Fingerprint of a profile from the fingerprint of the profile so far and that of the column merged into it.
+    """
+    return hashlib.sha1((fingerprint1 + fingerprint2).encode("utf-8")).hexdigest()
+
+
+def get_code_version():
+    """
+    Version of the feature tests: the hash of feature_cache_version and of the sources of the tests package,
+    so that results persisted by other code are not read.
+    """
+    global code_version
+    if code_version is None:
+        digest = hashlib.sha1(str(feature_cache_version).encode("utf-8"))
+        for path in sorted(glob.glob(os.path.join(tests_folder, "*.py"))):
+            if not os.path.basename(path).startswith("test_"):
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        code_version = digest.hexdigest()
+    return code_version
+
+
+class FeatureCache:
+    """
+    Results of the feature tests per pair of training and test columns, keyed by the test and the fingerprints
+    of the fields of both columns it reads. The least recently used results are evicted beyond max_size, results older than ttl seconds
+    expire, and the cache can be persisted to a pickle file.
+    """
+    def __init__(self, max_size, ttl=None, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        # key -> (result, time it was computed)
+        self.results = OrderedDict()
+        self.stats = Counter()
+        self.test_hits = Counter()
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key):
+        """
+        :return: Cached result, None if there is none or it expired.
+        """
+        entry = self.results.get(key)
+        if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+            del self.results[key]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.results.move_to_end(key)
+        self.stats["hits"] += 1
+        self.test_hits[key[0]] += 1
+        return entry[0]
+
+    def put(self, key, result):
+        self.results[key] = (result, time.time())
+        self.results.move_to_end(key)
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def get_stats(self):
+        """
+        :return: Hits, misses, hit rate, evicted and expired results, size of the cache and hits per test.
+        """
+        stats = dict([(key, self.stats[key]) for key in ["hits", "misses", "evicted", "expired"]])
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] * 1.0 / total if total else 0.0
+        stats["size"] = len(self.results)
+        stats["test_hits"] = dict(self.test_hits)
+        return stats
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, results = pickle.load(f)
+        except Exception as e:
+            logging.warning("Could not load feature cache {}: {}".format(self.path, e))
+            return
+        if version != get_code_version():
+            logging.info("Discarding feature cache {} of other feature tests".format(self.path))
+            return
+        logging.info("Loaded {} cached feature results from {}".format(len(results), self.path))
+        self.results = results
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump((get_code_version(), self.results), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.results = OrderedDict()
+
+
+def get_feature_cache():
+    """
+    :return: FeatureCache configured by utils.feature_cache_size, None if the cache is disabled.
+    """
+    global feature_cache
+    if not utils.feature_cache_size:
+        return None
+    if feature_cache is None:
+        feature_cache = FeatureCache(utils.feature_cache_size, utils.feature_cache_ttl, utils.feature_cache_path)
+    return feature_cache
+
+
+def save_feature_cache():
+    """
+    Log the hit rate of the feature cache and persist it if it has a path.
+    """
+    if feature_cache is None:
+        return
+    logging.info("Feature cache: {hits} hits, {misses} misses, hit rate {hit_rate:.2f}, {size} results".format(
+        **feature_cache.get_stats()))
+    feature_cache.save()
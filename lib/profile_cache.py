@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+
+from lib import utils
+
+__author__ = 'minh'
+
+# bump when the way sources are read changes, so that old profiles are not rehydrated
+profile_cache_version = 1
+# share of max_bytes the cache is evicted down to, so that the next saves do not evict again
+eviction_ratio = 0.9
+
+profile_cache = None
+
+
+class ProfileCache:
+    """
+    On-disk cache of parsed sources: every entry is a zlib compressed pickle of a Source with its columns,
+    keyed by the path, size and modification time of the data file and of its model files.
+    Entries are evicted least recently used first once the cache grows beyond max_bytes.
+    The size of the cache is listed once and then counted as entries are saved, the directory is only
+    listed again to evict. Processes sharing the directory each count their own saves.
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum([size for _, size, _ in self.get_entries()])
+
+    @staticmethod
+    def get_key(file_path, model_paths):
+        signature = [profile_cache_version, utils.sampling_policy, utils.sampling_size, utils.sampling_seed]
+        for path in [file_path] + list(model_paths):
+            stat = os.stat(path)
+            signature.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        return hashlib.sha1(repr(signature).encode("utf-8")).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".profile")
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                source = pickle.loads(zlib.decompress(f.read()))
+            # the modification time of an entry marks when it was used last
+            os.utime(path)
+            return source
+        except Exception as e:
+            logging.warning("Could not load cached profile {}: {}".format(path, e))
+            return None
+
+    def save(self, key, source):
+        path = self.get_path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        data = zlib.compress(pickle.dumps(source, pickle.HIGHEST_PROTOCOL))
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def get_entries(self):
+        """
+        :return: List of (modification time, size, file name) of the cached profiles.
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".profile"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def evict(self):
+        entries = self.get_entries()
+        total = sum([size for _, size, _ in entries])
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes * eviction_ratio:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+                logging.info("Evicted cached profile {}".format(filename))
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".profile"):
+                os.remove(os.path.join(self.cache_dir, filename))
+        self.size = 0
+
+
+def get_profile_cache():
+    """
+    :return: ProfileCache configured by utils.profile_cache_dir, None if the cache is disabled.
+    """
+    global profile_cache
+    if not utils.profile_cache_dir:
+        return None
+    if profile_cache is None or profile_cache.cache_dir != utils.profile_cache_dir:
+        profile_cache = ProfileCache(utils.profile_cache_dir, utils.profile_cache_max_bytes)
+    return profile_cache
@@ -0,0 +1,144 @@
+from functools import partial
+import random
+
+from lib import utils
+from lib.utils import number_pattern
+
+__author__ = 'minh'
+
+HEAD_SAMPLING = "head"
+RESERVOIR_SAMPLING = "reservoir"
+STRATIFIED_SAMPLING = "stratified"
+
+
+def is_empty(value):
+    return not value or value.strip() in ("", "NULL")
+
+
+class HeadSampler:
+    """
+    Keeps the first size values of a column.
+    """
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.count = 0
+        self.sample = []
+
+    def append(self, value):
+        if not is_empty(value):
+            self.add(value)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __iter__(self):
+        return iter(self.sample)
+
+    def __len__(self):
+        return len(self.sample)
+
+
+class ReservoirSampler(HeadSampler):
+    """
+    Keeps a uniform random sample of size values of a column (algorithm R).
+    Sampled values are returned in the order in which they were read.
+    """
+    def __init__(self, size, seed=None):
+        HeadSampler.__init__(self, size)
+        self.random = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        if len(self.sample) < self.size:
+            self.sample.append((self.count, value))
+        else:
+            idx = self.random.randrange(self.count)
+            if idx < self.size:
+                self.sample[idx] = (self.count, value)
+
+    def __iter__(self):
+        return iter([value for _, value in sorted(self.sample)])
+
+
+class StratifiedSampler(HeadSampler):
+    """
+    Keeps a random sample of size values of a column in which numeric, textual and mixed values
+    have the same proportions as in the whole column.
+    Every stratum is sampled with its own reservoir, so at most 3 * size values are held while reading.
+    The sample is drawn on the first iteration and kept until more values are added,
+    so that every pass over the column sees the same values.
+    """
+    def __init__(self, size, seed=None):
+        HeadSampler.__init__(self, size)
+        self.random = random.Random(seed)
+        self.strata = {}
+        self.selection = None
+
+    @staticmethod
+    def get_stratum(value):
+        has_number = number_pattern.search(value) is not None
+        has_text = bool(number_pattern.sub("", value.strip()))
+        if has_number and has_text:
+            return "mixed"
+        return "numeric" if has_number else "textual"
+
+    def add(self, value):
+        self.count += 1
+        self.selection = None
+        stratum = self.get_stratum(value)
+        if stratum not in self.strata:
+            self.strata[stratum] = ReservoirSampler(self.size, self.random.random())
+        # keep the position in the column so that the strata can be merged in reading order
+        self.strata[stratum].add((self.count, value))
+
+    def __iter__(self):
+        if self.selection is None:
+            self.selection = self.select()
+        return iter(self.selection)
+
+    def select(self):
+        if self.count <= self.size:
+            sample = [item for sampler in self.strata.values() for _, item in sampler.sample]
+            return [value for _, value in sorted(sample)]
+        # largest remainder allocation of the sample size to the strata
+        quotas = dict([(stratum, self.size * sampler.count * 1.0 / self.count)
+                       for stratum, sampler in self.strata.items()])
+        sizes = dict([(stratum, int(quota)) for stratum, quota in quotas.items()])
+        remainders = sorted(quotas.keys(), key=lambda stratum: sizes[stratum] - quotas[stratum])
+        for stratum in remainders[:self.size - sum(sizes.values())]:
+            sizes[stratum] += 1
+        sample = []
+        for stratum, sampler in self.strata.items():
+            items = [item for _, item in sampler.sample]
+            sample.extend(self.random.sample(items, sizes[stratum]))
+        return [value for _, value in sorted(sample)]
+
+    def __len__(self):
+        return min(self.size, self.count)
+
+
+samplers = {HEAD_SAMPLING: HeadSampler, RESERVOIR_SAMPLING: ReservoirSampler, STRATIFIED_SAMPLING: StratifiedSampler}
+
+
+def get_sampler_factory(policy=None, size=None, seed=None):
+    """
+    Factory for the containers in which source readers collect the values of a column.
+    :param policy: head, reservoir, stratified or None to keep all values. Defaults to utils.sampling_policy.
+    :param size: Number of values sampled per column. Defaults to utils.sampling_size.
+    :param seed: Seed of the random samplers. Defaults to utils.sampling_seed.
+    :return: Function creating an empty container with append and extend.
+    """
+    policy = policy or utils.sampling_policy
+    if policy is None:
+        return list
+    if policy not in samplers:
+        raise ValueError("Unknown sampling policy: {}".format(policy))
+    size = size or utils.sampling_size
+    seed = utils.sampling_seed if seed is None else seed
+    return partial(samplers[policy], size, seed)
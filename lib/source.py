@@ -1,12 +1,16 @@
+import codecs
 import csv
+import io
 import json
+from collections import defaultdict
 import re
 from xml.etree import ElementTree
 import logging
 import random
 
 from .column import Column
-from lib import indexer
+from lib import get_indexer, utils
+from lib.sampling import get_sampler_factory
 from lib.utils import not_allowed_chars
 
 __author__ = 'alse'
@@ -14,31 +18,147 @@ __author__ = 'alse'
 
 class Source(object):
 
+    encodings = ["utf-8", "utf-16", "iso-8859-1", "latin-1", "windows-1252"]
+    # the encoding is detected on the start of the file in this buffer, which is then parsed without reading it again
+    buffer_size = 2 ** 20
+    # bytes decoded at a time while detecting the encoding
+    detection_chunk_size = 2 ** 13
+    # a json number which runs to the end of the buffer, it has no terminator and may continue in the next chunk
+    json_number_end = re.compile(r"[-0-9][-+0-9.eE]*\Z")
+
+    @staticmethod
+    def detect_encoding(f, limit=100):
+        """
+        Helper function to determine encoding of a binary stream, the stream is left at its start.
+        Only the bytes already in the buffer of the stream are decoded, at most until limit lines,
+        so a file of one long line is not read as a whole. For now 5 encodings are checked.
+        :param f: Buffered binary stream of the file.
+        :param limit: How many lines will be read in to determine the encoding.
+        :return:
+        """
+        prefix = f.peek(Source.buffer_size)[:Source.buffer_size]
+        for enc in Source.encodings:
+            decoder = codecs.getincrementaldecoder(enc)()
+            lines = 0
+            try:
+                for start in range(0, len(prefix), Source.detection_chunk_size):
+                    lines += decoder.decode(prefix[start:start + Source.detection_chunk_size]).count("\n")
+                    if lines >= limit:
+                        break
+                else:
+                    # the whole file is in the buffer, it must not end in the middle of a character
+                    if len(prefix) < Source.buffer_size:
+                        decoder.decode(b"", final=True)
+                return enc
+            except UnicodeError:
+                continue
+        return
+
     @staticmethod
     def find_source_encoding(file_path, limit=100):
         """
         Helper function to determine encoding of the file.
-        For now 5 encodings are checked.
         :param file_path: Path of the file.
         :param limit: How many lines will be read in to determine the encoding.
         :return:
         """
-        encodings = ["utf-8", "utf-16", "iso-8859-1", "latin-1", "windows-1252"]
-        for enc in encodings:
+        with open(file_path, "rb", buffering=Source.buffer_size) as f:
+            enc = Source.detect_encoding(f, limit)
+        if enc is None:
+            logging.error("Correct encoding was not found: {}".format(file_path))
+        return enc
+
+    @staticmethod
+    def open_source(file_path):
+        """
+        Open the file for one sequential read, the encoding is detected on the buffered start of the file.
+        :param file_path: Path of the file.
+        :return: Text stream, decoded like the file opened with the detected encoding.
+        """
+        f = open(file_path, "rb", buffering=Source.buffer_size)
+        enc = Source.detect_encoding(f)
+        if enc is None:
+            logging.error("Correct encoding was not found: {}".format(file_path))
+        return io.TextIOWrapper(f, encoding=enc)
+
+    @staticmethod
+    def iter_json_array(f, chunk_size=2 ** 16):
+        """
+        Iterate over the elements of a json array without loading the whole array.
+        Files which do not hold an array are loaded completely.
+        :param f: Text stream of the file.
+        :param chunk_size: How many characters are read at a time.
+        :return: Generator of the decoded elements.
+        """
+        decoder = json.JSONDecoder()
+        min_chunk_size = chunk_size
+        buffer = f.read(chunk_size)
+        is_eof = not buffer
+        idx = len(buffer) - len(buffer.lstrip())
+        if buffer[idx:idx + 1] != "[":
+            for node in json.loads(buffer + f.read()):
+                yield node
+            return
+        idx += 1
+        while True:
+            while idx < len(buffer) and buffer[idx] in " \t\r\n,":
+                idx += 1
+            if idx < len(buffer) and buffer[idx] == "]":
+                return
             try:
-                with open(file_path, "r", encoding=enc) as f:
-                    [f.readline() for _ in range(limit)]
-                return enc
-            except:
+                if idx == len(buffer) or (not is_eof and Source.json_number_end.match(buffer, idx)):
+                    raise ValueError("End of buffer")
+                node, end = decoder.raw_decode(buffer, idx)
+                # a value ending with the buffer might continue in the next chunk
+                if end == len(buffer) and not is_eof:
+                    raise ValueError("End of buffer")
+            except ValueError:
+                if is_eof:
+                    raise
+                chunk = f.read(chunk_size)
+                is_eof = not chunk
+                buffer = buffer[idx:] + chunk
+                idx = 0
+                chunk_size *= 2
                 continue
-        logging.error("Correct encoding was not found: {}".format(file_path))
-        return
+            chunk_size = max(chunk_size // 2, min_chunk_size)
+            idx = end
+            yield node
 
-    def __init__(self, name):
+    @staticmethod
+    def iter_xml_children(f):
+        """
+        Iterate over the children of the root element, each child is cleared once it has been consumed.
+        :param f: Text stream of the file.
+        :return: Generator of complete child elements.
+        """
+        depth = 0
+        root = None
+        for event, element in ElementTree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if root is None:
+                    root = element
+                continue
+            depth -= 1
+            if depth == 1:
+                yield element
+                element.clear()
+                root.clear()
+
+    def __init__(self, name, sampling_policy=None, sampling_size=None):
+        """
+        :param name: Name of the source.
+        :param sampling_policy: How the file readers sample the values of a column, see lib.sampling.
+                                Defaults to utils.sampling_policy.
+        :param sampling_size: Number of values sampled per column. Defaults to utils.sampling_size.
+        """
         logging.debug("Initializing source: {}".format(name))
         self.name = name
         self.index_name = re.sub(not_allowed_chars, "", self.name)
         self.column_map = {}
+        self.sampling_policy = sampling_policy
+        self.sampling_size = sampling_size
 
     def __str__(self):
         return "<Source: " + str(self.name) + ">"
@@ -46,9 +166,20 @@ class Source(object):
     def __repr__(self):
         return self.__str__()
 
+    def memory_usage(self):
+        """
+        Approximate memory held by the columns of the source.
+        :return: Map from column key to bytes, with the sum under "total".
+        """
+        usage = {}
+        for key, column in self.column_map.items():
+            usage[key] = column.memory_usage()["total"]
+        usage["total"] = sum(usage.values())
+        return usage
+
     def save(self, index_config):
         logging.info("Saving source: {}".format(self.name))
-        indexer.index_source(source=self, index_config=index_config)
+        get_indexer().index_source(source=self, index_config=index_config)
 
     def write_column_map(self, filepath, filter_unknown=False):
         logging.info("Writing column map to {}".format(filepath))
@@ -65,8 +196,7 @@ class Source(object):
                 writer.writerow([key, col.name, col.source_name, col.semantic_type])
 
     def read_semantic_type_json(self, file_path):
-        enc = self.find_source_encoding(file_path)
-        with open(file_path, 'r', encoding=enc) as f:
+        with self.open_source(file_path) as f:
             logging.info("Reading semantic type json: {}".format(file_path))
             data = json.load(f)
             node_array = data["graph"]["nodes"]
@@ -115,16 +245,45 @@ class Source(object):
                         output_list.append("")
                 writer.writerow(output_list)
 
+    def new_value_list(self):
+        """
+        Container in which a reader collects the values of a column, bounded by the sampling policy.
+        :return:
+        """
+        return get_sampler_factory(self.sampling_policy, self.sampling_size)()
+
+    def add_column_values(self, value_map):
+        """
+        Add values collected by a reader to the columns of this source.
+        :param value_map: Map from column key in column_map to the list of raw values.
+        :return:
+        """
+        for header, values in value_map.items():
+            self.column_map[header].add_values(values)
+
+    def flush_column_values(self, value_map, record_count):
+        """
+        Add the values of every utils.bulk_chunk_size records to the columns when the values are not sampled,
+        so that a streaming reader holds the raw values of one chunk of records instead of the whole file.
+        Sampled values are bounded by their samplers, which must see all the values of a column.
+        :param value_map: Map from column key in column_map to the values collected since the last flush.
+        :param record_count: Records read so far.
+        :return:
+        """
+        if record_count % utils.bulk_chunk_size or \
+                get_sampler_factory(self.sampling_policy, self.sampling_size) is not list:
+            return
+        self.add_column_values(value_map)
+        value_map.clear()
+
     def read_data_from_dict(self, data):
         logging.info("Reading data from dict: {}".format(self.name))
         for header in data.keys():
             self.column_map[header] = Column(header)
-            for element in data[header]:
-                self.column_map[header].add_value(element)
+            self.column_map[header].add_values(data[header])
 
     def read_data_from_csv(self, file_path):
-        correct_encoding = self.find_source_encoding(file_path)
-        with open(file_path, encoding=correct_encoding) as csv_file:
+        with self.open_source(file_path) as csv_file:
             logging.info("Reading data from csv: {} ".format(file_path))
             reader = csv.DictReader(csv_file)
             headers = reader.fieldnames
@@ -135,14 +294,15 @@ class Source(object):
                     #for weather 2 data
                     # self.column_map[header].semantic_type = header
 
+            value_map = defaultdict(self.new_value_list)
             for row in reader:
                 for header in row.keys():
                     if header:
-                        self.column_map[header.replace(" ", "")].add_value(row[header])
+                        value_map[header.replace(" ", "")].append(row[header])
+            self.add_column_values(value_map)
 
     def read_data_from_wc_csv(self, file_path):
-        correct_encoding = self.find_source_encoding(file_path)
-        with open(file_path, encoding=correct_encoding) as csv_file:
+        with self.open_source(file_path) as csv_file:
             logging.info("Reading data from wc csv: {}".format(file_path))
             reader = csv.DictReader(csv_file)
             headers = reader.fieldnames
@@ -151,9 +311,10 @@ class Source(object):
                 self.column_map[header] = Column(header, file_path)
 
             idx = 0
+            value_map = defaultdict(self.new_value_list)
             for row in reader:
                 if idx == 0:
-                    for header in self.column_map.keys():
+                    for header in list(self.column_map.keys()):
                         if "ontology" not in row[header]:
                             del self.column_map[header]
                         else:
@@ -163,54 +324,54 @@ class Source(object):
                 else:
                     for header in self.column_map.keys():
                         # if "http://" in row[header]:
-                        #     self.column_map[header].add_value(row[header].split("/")[-1].replace("_", " "))
+                        #     value_map[header].append(row[header].split("/")[-1].replace("_", " "))
                         # else:
-                        self.column_map[header].add_value(row[header])
+                        value_map[header].append(row[header])
+            self.add_column_values(value_map)
 
     def read_data_from_json(self, file_path):
-        enc = self.find_source_encoding(file_path)
-        with open(file_path, 'r', encoding=enc) as f:
+        with self.open_source(file_path) as f:
             logging.info("Reading data from json: {}".format(file_path))
-            json_array = json.load(f)
-            for node in json_array:
+            value_map = defaultdict(self.new_value_list)
+            for record_count, node in enumerate(self.iter_json_array(f), 1):
                 for field in node.keys():
                     if field not in self.column_map:
                         column = Column(field, file_path)
                         self.column_map[field] = column
                     if isinstance(node[field], list):
-                        for value in node[field]:
-                            self.column_map[field].add_value(str(value))
+                        value_map[field].extend([str(value) for value in node[field]])
                     elif isinstance(node[field], dict):
                         for field1 in node[field].keys():
                             if field1 not in self.column_map:
                                 column = Column(field1, file_path)
                                 self.column_map[field1] = column
-                            self.column_map[field1].add_value(str(node[field][field1]))
+                            value_map[field1].append(str(node[field][field1]))
                     else:
-                        self.column_map[field].add_value(str(node[field]))
+                        value_map[field].append(str(node[field]))
+                self.flush_column_values(value_map, record_count)
+            self.add_column_values(value_map)
 
     def read_data_from_xml(self, file_path):
-        correct_encoding = self.find_source_encoding(file_path)
-        with open(file_path, 'r', encoding=correct_encoding) as f:
+        with self.open_source(file_path) as f:
             logging.info("Reading data from xml: {}".format(file_path))
-            xml_tree = ElementTree.parse(f)
-            root = xml_tree.getroot()
-            for child in root:
+            value_map = defaultdict(self.new_value_list)
+            for record_count, child in enumerate(self.iter_xml_children(f), 1):
                 for attrib_name in child.attrib.keys():
                     if attrib_name not in self.column_map:
                         column = Column(attrib_name, file_path)
                         self.column_map[attrib_name] = column
-                    self.column_map[attrib_name].add_value(child.attrib[attrib_name])
+                    value_map[attrib_name].append(child.attrib[attrib_name])
                 for attrib in child:
                     if attrib.tag not in self.column_map:
                         column = Column(attrib.tag, file_path)
                         self.column_map[attrib.tag] = column
-                    self.column_map[attrib.tag].add_value(attrib.text)
+                    value_map[attrib.tag].append(attrib.text)
+                self.flush_column_values(value_map, record_count)
+            self.add_column_values(value_map)
 
     def read_semantic_type_from_gold(self, file_path):
         logging.info("Reading semantic type from gold: {}".format(file_path))
-        correct_encoding = self.find_source_encoding(file_path)
-        with open(file_path, 'r', encoding=correct_encoding) as f:
+        with self.open_source(file_path) as f:
             csv_reader = csv.reader(f)
             for row in csv_reader:
                 if len(row) > 1 and row[1].strip() in self.column_map:
@@ -218,8 +379,7 @@ class Source(object):
 
     def read_data_from_text_file(self, file_path):
         logging.info("Reading data from text file: {}".format(file_path))
-        correct_encoding = self.find_source_encoding(file_path)
-        with open(file_path, 'r', encoding=correct_encoding) as f:
+        with self.open_source(file_path) as f:
             num_types = int(f.readline())
             # headers are randomly sampled numbers from (1000,9999)
             up = (10**4)-1
@@ -232,7 +392,8 @@ class Source(object):
                 column.semantic_type = "---".join(
                     [part.split("/")[-1] for part in semantic_type.replace("#", "").split("|")])
                 num_values = int(f.readline())
-                for num_val in range(num_values):
-                    column.add_value(f.readline().split(" ", 1)[1])
+                values = self.new_value_list()
+                values.extend([f.readline().split(" ", 1)[1] for _ in range(num_values)])
+                column.add_values(values)
                 f.readline()
                 self.column_map[column.name] = column
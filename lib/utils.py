@@ -1,7 +1,12 @@
+import os
 import re
 import logging
+from collections import Counter
+from fnmatch import fnmatchcase
 
-from main import sc
+import numpy as np
+
+from main import get_spark_context
 
 __author__ = 'minh'
 #
@@ -12,17 +17,135 @@ not_allowed_chars = '[\/*?"<>|\s\t]'
 
 is_column_based = True
 is_tree_based = False
+# columns with more values than this are sent to spark to compute their histogram, None to never use spark
+spark_histogram_threshold = 1000000
+# backend computing the features of a column against the training columns:
+# "serial", "thread", "process" or "spark", see lib.executor
+execution_backend = "serial"
+# number of workers of the thread and process pools, None for the pool default
+execution_workers = None
+# values kept per column by the source readers: "head", "reservoir", "stratified" or None to keep all, see lib.sampling
+sampling_policy = None
+sampling_size = 10000
+sampling_seed = 0
+# processes reading the data files of a folder, 1 reads them in the calling process, None uses all cores
+ingestion_workers = 1
+# directory of the on-disk cache of parsed sources, e.g. os.path.join("data", "profile_cache"),
+# None disables it, see lib.profile_cache
+profile_cache_dir = None
+# the least recently used cached sources are evicted once the cache grows beyond this size
+profile_cache_max_bytes = 2 ** 30
+# documents per bulk request when indexing sources and number of concurrent bulk requests, see search.indexer
+bulk_chunk_size = 500
+bulk_thread_count = 1
+# training columns per test column on which get_test_results runs the expensive statistical tests,
+# ranked by cheap signals, None runs them on all columns, see tests.integrated
+prefilter_top_k = None
+# compiled abbreviation patterns kept by the ABBR test, None keeps all, see tests.textual
+abbr_pattern_cache_size = 4096
+# hash functions of the minhash sketches of textual_set stored with the columns when jaccard_error is set,
+# None stores no sketch
+minhash_size = 400
+# error bound of the JACCARD test computed on the sketches, None computes it exactly on textual_set,
+# training columns with at most jaccard_exact_max_size distinct values are always compared exactly, see tests.textual
+jaccard_error = None
+jaccard_exact_max_size = 1000
+# pair results of the feature tests kept by the feature cache, e.g. 100000, None disables it and the fingerprints
+# of the columns it is keyed by, see lib.feature_cache
+feature_cache_size = None
+# seconds after which a cached result expires, None keeps results until they are evicted
+feature_cache_ttl = None
+# file the feature cache is persisted to, None keeps it in memory only
+feature_cache_path = None
+# searches sent in one msearch request by Searcher.search_similar_text_data_batch, None sends all in one request
+msearch_batch_size = 500
+# "elasticsearch" or "embedded" to search an in-process index persisted to embedded_index_path, see search.embedded
+search_backend = "elasticsearch"
+embedded_index_path = os.path.join("data", "embedded_index.pickle")
+
+not_allowed_pattern = re.compile(not_allowed_chars)
+number_pattern = re.compile(r"(\d+(\.\d+([Ee]\d+)?)?)")
+# joins values of a column so that they can be processed in one regex pass,
+# neither pattern above can match or remove it
+value_separator = "\x00"
 
 
 def split_number_text(example):
-    numbers = re.findall(r"(\d+(\.\d+([Ee]\d+)?)?)", example)
-    text = re.sub(r"(\d+(\.\d+([Ee]\d+)?)?)", "", example)
+    numbers = number_pattern.findall(example)
+    text = number_pattern.sub("", example)
     return numbers, text
 
 
+def normalize_values(values):
+    """
+    Clean a batch of raw values the same way as a single value is cleaned:
+    strip, drop empty and NULL values, drop non ascii characters and replace not allowed chars.
+    :param values: Iterable of raw values.
+    :return: List of normalized values.
+    """
+    values = [value.strip() for value in values if value]
+    values = [value for value in values if value and value != "NULL"]
+    if not values:
+        return []
+    joined = value_separator.join(values)
+    if joined.count(value_separator) != len(values) - 1:
+        # separator occurs inside a value, clean values one by one
+        return [not_allowed_pattern.sub(" ", value.encode("ascii", "ignore").decode()) for value in values]
+    # String handling is different in Python3 from what it was in Python2
+    # All strings are by default unicode
+    joined = not_allowed_pattern.sub(" ", joined.encode("ascii", "ignore").decode())
+    return joined.split(value_separator)
+
+
+def split_number_text_batch(values):
+    """
+    Split a batch of normalized values into their textual parts and the largest number in each value.
+    :param values: List of normalized values.
+    :return: (texts, numbers) where texts has one entry per value and numbers is
+             a list of (value index, largest number) for values which contain a number.
+    """
+    if not values:
+        return [], []
+    joined = value_separator.join(values)
+    if joined.count(value_separator) != len(values) - 1:
+        texts = [number_pattern.sub("", value) for value in values]
+        numbers = [(idx, max(float(v[0]) for v in number_pattern.findall(value)))
+                   for idx, value in enumerate(values) if number_pattern.search(value)]
+        return texts, numbers
+    texts = number_pattern.sub("", joined).split(value_separator)
+
+    matches = [(match.start(), match.group(0)) for match in number_pattern.finditer(joined)]
+    if not matches:
+        return texts, []
+    value_ends = np.cumsum([len(value) + 1 for value in values])
+    indices = np.searchsorted(value_ends, [start for start, _ in matches], side="right")
+    parsed = np.array([number for _, number in matches], dtype=float)
+    starts = np.flatnonzero(np.r_[True, indices[1:] != indices[:-1]])
+    maximums = np.maximum.reduceat(parsed, starts)
+    return texts, list(zip(indices[starts].tolist(), maximums.tolist()))
+
+
 def get_distribution(data):
+    """
+    Histogram of value frequencies: the rank of each distinct value (most frequent first)
+    repeated by the percentage of the data it covers.
+    Columns larger than spark_histogram_threshold are counted with spark.
+    :param data: List of values.
+    :return: List of ranks.
+    """
+    if spark_histogram_threshold is not None and len(data) > spark_histogram_threshold:
+        return get_spark_distribution(data)
+    logging.debug("Getting distribution locally")
+    counts = sorted(Counter(data).values(), reverse=True)
+    histogram = []
+    for idx, count in enumerate(counts):
+        histogram.extend([idx] * int(count * 100.0 / len(data)))
+    return histogram
+
+
+def get_spark_distribution(data):
     logging.debug("Getting distribution with spark")
-    return sc.parallelize(data).map(lambda word: (word, 1)).reduceByKey(lambda x, y: x + y).sortBy(
+    return get_spark_context().parallelize(data).map(lambda word: (word, 1)).reduceByKey(lambda x, y: x + y).sortBy(
         lambda x: -x[1]).zipWithIndex().flatMap(
         lambda x: [x[1]] * int(x[0][1] * 100.0 / len(data))).collect()
 
@@ -33,6 +156,15 @@ def get_index_name(index_config):
     return str(index_config['name']).lower()
 
 
+def match_index(index_pattern, index_name):
+    """
+    Whether an index is searched by an index pattern as understood by elasticsearch, e.g. "", "a*,b".
+    """
+    if not index_pattern:
+        return True
+    return any([fnmatchcase(index_name, pattern) for pattern in index_pattern.split(",")])
+
+
 def get_new_index_name(semantic_type, source_type):
     domain = semantic_type["domain"]["uri"].split("/")[-1]
     _type = semantic_type["type"]["uri"].split("/")[-1]
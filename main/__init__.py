@@ -1,23 +1,8 @@
 import os
 
-from gensim.models import Word2Vec
-
 # configure spark to be started with more allocated memory
 memory = '12g'
-pyspark_submit_args = ' --driver-memory ' + memory + ' pyspark-shell'
-os.environ["PYSPARK_SUBMIT_ARGS"] = pyspark_submit_args
-
-from pyspark import SparkConf, SparkContext, SQLContext
-
-conf = (SparkConf()
-        .setMaster("local")
-        .setAppName("KarmaDSL")
-        .set("spark.executor.cores","8")
-        .set("spark.executor.memory", "1g")
-        )
-
-sc = SparkContext(conf=conf)
-sql_context = SQLContext(sc)
+spark_master = "local"
 
 root_dir = os.path.abspath(os.path.join(os.path.realpath(__file__), '..'))
 data_dir = os.path.join(root_dir, "data/datasets")
@@ -25,8 +10,45 @@ train_model_dir = os.path.join(root_dir, "data/train_models")
 
 # word2vec = Word2Vec.load_word2vec_format(os.path.join("/Users/minhpham/tools/", 'GoogleNews-vectors-negative300.bin'), binary=True)
 
-file_write = open('debug.txt', 'w')
+# spark, its JVM and the debug file are only started on first use
+spark_context = None
+sql_context = None
+debug_file = None
+
+
+def get_spark_context():
+    global spark_context
+    if spark_context is None:
+        pyspark_submit_args = ' --driver-memory ' + memory + ' pyspark-shell'
+        os.environ["PYSPARK_SUBMIT_ARGS"] = pyspark_submit_args
+
+        from pyspark import SparkConf, SparkContext
+
+        conf = (SparkConf()
+                .setMaster(spark_master)
+                .setAppName("KarmaDSL")
+                .set("spark.executor.cores", "8")
+                .set("spark.executor.memory", "1g")
+                )
+
+        spark_context = SparkContext(conf=conf)
+
+        logger = spark_context._jvm.org.apache.log4j
+        logger.LogManager.getLogger("org").setLevel(logger.Level.FATAL)
+        logger.LogManager.getLogger("akka").setLevel(logger.Level.FATAL)
+    return spark_context
+
+
+def get_sql_context():
+    global sql_context
+    if sql_context is None:
+        from pyspark import SQLContext
+        sql_context = SQLContext(get_spark_context())
+    return sql_context
+
 
-logger = sc._jvm.org.apache.log4j
-logger.LogManager.getLogger("org").setLevel(logger.Level.FATAL)
-logger.LogManager.getLogger("akka").setLevel(logger.Level.FATAL)
+def get_debug_file():
+    global debug_file
+    if debug_file is None:
+        debug_file = open('debug.txt', 'w')
+    return debug_file
@@ -0,0 +1,72 @@
+import random
+import subprocess
+import sys
+import time
+
+from lib.column import Column
+
+__author__ = 'alse'
+
+# seconds allowed for importing a module in a fresh interpreter,
+# none of them should start spark or connect to elasticsearch
+import_time_budget = {"lib.column": 0.5, "server": 1.5}
+
+
+def generate_values(size):
+    words = ["museum", "artist", "painting", "oil", "canvas", "bronze", "portrait", "landscape"]
+    values = []
+    for idx in range(size):
+        if idx % 3 == 0:
+            values.append(str(random.uniform(0, 10000)))
+        else:
+            values.append(" ".join(random.sample(words, 3)) + " " + str(idx))
+    return values
+
+
+def benchmark_column_ingestion(sizes=(1000, 10000, 100000)):
+    """
+    Time profiling of synthetic columns value by value through Column.add_value
+    and in one batch through Column.add_values.
+    :param sizes: Number of values per column.
+    :return: List of (size, seconds per value, seconds in batch) tuples.
+    """
+    results = []
+    for size in sizes:
+        values = generate_values(size)
+        column = Column("benchmark")
+        start_time = time.time()
+        for value in values:
+            column.add_value(value)
+        column.to_json()
+        running_time = time.time() - start_time
+        print("Column ingestion: {} values in {:.3f}s".format(size, running_time))
+
+        column = Column("benchmark")
+        start_time = time.time()
+        column.add_values(values)
+        column.to_json()
+        batch_running_time = time.time() - start_time
+        print("Column batch ingestion: {} values in {:.3f}s".format(size, batch_running_time))
+        results.append((size, running_time, batch_running_time))
+    return results
+
+
+def benchmark_import_time(budget=None):
+    """
+    Time the import of modules in a fresh interpreter and check them against their budget.
+    :param budget: Map from module name to allowed seconds, defaults to import_time_budget.
+    :return: Map from module name to (seconds, within budget).
+    """
+    budget = budget or import_time_budget
+    results = {}
+    for module, allowed in budget.items():
+        code = "import time; start_time = time.time(); import {}; print(time.time() - start_time)".format(module)
+        running_time = float(subprocess.check_output([sys.executable, "-c", code]).decode().split()[-1])
+        print("Import {}: {:.3f}s (budget {:.3f}s)".format(module, running_time, allowed))
+        results[module] = (running_time, running_time <= allowed)
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_import_time()
+    benchmark_column_ingestion()
@@ -12,6 +12,7 @@ from main.semantic_labeler import SemanticLabeler
 __author__ = 'alse'
 
 import logging
+import logging.handlers
 import os
 
 # logging
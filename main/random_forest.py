@@ -2,12 +2,9 @@ import os
 
 import numpy as np
 import pandas as pd
-# from costcla import CostSensitiveRandomForestClassifier
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
 import logging
 
-from lib import searcher
+from lib import get_searcher
 from lib.utils import is_tree_based
 from tests.integrated import feature_list, tree_feature_list
 
@@ -23,6 +20,7 @@ class MyRandomForest:
 
     def generate_train_data(self, train_sizes):
         logging.info("Generating train data")
+        searcher = get_searcher()
         train_data = []
         for data_set in self.data_sets:
             train_data = []
@@ -34,18 +32,19 @@ class MyRandomForest:
                     train_names = [source.index_name for source in double_name_list[idx + 1: idx + size + 1]]
                     train_examples_map = searcher.search_types_data(index_config, train_names)
                     source = source_map[source_name]
-                    for column in source.column_map.values():
-                        if column.semantic_type:
-                            textual_train_map = searcher.search_similar_text_data(index_config,
-                                                                                  column.value_text,
-                                                                                  train_names)
-                            feature_vectors = column.generate_candidate_types(train_examples_map, textual_train_map,
-                                                                              is_labeled=True)
-                            train_data += feature_vectors
+                    columns = [column for column in source.column_map.values() if column.semantic_type]
+                    textual_train_maps = searcher.search_similar_text_data_batch(
+                        [(index_config, column.value_text, train_names) for column in columns])
+                    for column, textual_train_map in zip(columns, textual_train_maps):
+                        feature_vectors = column.generate_candidate_types(train_examples_map, textual_train_map,
+                                                                          is_labeled=True)
+                        train_data += feature_vectors
         return train_data
 
     def train(self, train_sizes):
         logging.info("Training random forest")
+        # from costcla import CostSensitiveRandomForestClassifier
+        from sklearn.linear_model import LogisticRegression
         if os.path.exists(self.model_path):
             train_df = self.load()
         else:
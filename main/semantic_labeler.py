@@ -3,18 +3,66 @@ import os
 import re
 import time
 from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from importlib import reload
 import logging
 
-from lib import searcher, indexer
+from lib import get_searcher, get_indexer
+from lib import utils
+from lib.feature_cache import save_feature_cache
+from lib.profile_cache import get_profile_cache
 from lib.source import Source
 from lib.utils import not_allowed_chars
-from main import file_write
+from main import get_debug_file
 from main.random_forest import MyRandomForest
 
 __author__ = 'alse'
 
 
+def read_data_source(file_path, is_full=False, model_paths=()):
+    """
+    Read one data source and its semantic types, runs in the ingestion worker processes.
+    Sources are rehydrated from the profile cache when neither the data file nor its model files changed.
+    :param file_path: Path of the data file.
+    :param is_full: Whether the file is in a folder of full web tables, which are read as wc csv.
+    :param model_paths: Paths of the model or gold files with the semantic types of the source.
+    :return: (source, seconds spent reading, whether the source came from the profile cache)
+    """
+    start_time = time.time()
+    profile_cache = get_profile_cache()
+    if profile_cache:
+        key = profile_cache.get_key(file_path, model_paths)
+        source = profile_cache.load(key)
+        if source is not None:
+            return source, time.time() - start_time, True
+
+    filename = os.path.basename(file_path)
+    extension = os.path.splitext(filename)[1]
+    source = Source(os.path.splitext(filename)[0])
+
+    if is_full:
+        source.read_data_from_wc_csv(file_path)
+    elif extension == ".csv":
+        source.read_data_from_csv(file_path)
+    elif extension == ".json":
+        source.read_data_from_json(file_path)
+    elif extension == ".xml":
+        source.read_data_from_xml(file_path)
+    else:
+        source.read_data_from_text_file(file_path)
+
+    for model_path in model_paths:
+        if os.path.splitext(model_path)[1] == ".json":
+            source.read_semantic_type_json(model_path)
+        else:
+            print(source)
+            source.read_semantic_type_from_gold(model_path)
+
+    if profile_cache:
+        profile_cache.save(key, source)
+    return source, time.time() - start_time, False
+
+
 class SemanticLabeler:
     def __init__(self, data_folder=os.path.join("data", "datasets")):
         logging.info("Initializing semantic labeler with data folder: {}".format(data_folder))
@@ -22,16 +70,25 @@ class SemanticLabeler:
         self.dataset_map = {}
         self.file_class_map = {}
         self.random_forest = None
+        # seconds spent reading each data source, by folder
+        self.ingestion_times = {}
 
     def reset(self):
         logging.info("Resetting semantic labeler")
         self.dataset_map = {}
         self.file_class_map = {}
         self.random_forest = None
+        self.ingestion_times = {}
         logging.info("Cleaning elasticsearch indexer")
-        indexer.clean()
+        get_indexer().clean()
 
     def read_data_sources(self, folder_paths):
+        """
+        Read all data sources of the folders and their semantic types from the model files.
+        Data files are read in utils.ingestion_workers processes, sources keep the order of their file names.
+        :param folder_paths: Names of the folders in data_folder.
+        :return:
+        """
         logging.info("Reading data sources...")
         for folder_name in folder_paths:
             folder_path = os.path.join(self.data_folder, folder_name)
@@ -40,47 +97,55 @@ class SemanticLabeler:
             data_folder_path = os.path.join(folder_path, "data")
             model_folder_path = os.path.join(folder_path, "model")
 
-            for filename in os.listdir(data_folder_path):
-                extension = os.path.splitext(filename)[1]
-
-                if ".DS" in filename:
-                    continue
-                logging.info("   ...file: {}".format(filename))
-                print(filename)
-
-                source = Source(os.path.splitext(filename)[0])
-                file_path = os.path.join(data_folder_path, filename)
-
-                if "full" in data_folder_path:
-                    source.read_data_from_wc_csv(file_path)
-                elif extension == ".csv":
-                    source.read_data_from_csv(file_path)
-                elif extension == ".json":
-                    source.read_data_from_json(file_path)
-                elif extension == ".xml":
-                    source.read_data_from_xml(file_path)
-                else:
-                    source.read_data_from_text_file(file_path)
-                source_map[filename] = source
+            filenames = [filename for filename in sorted(os.listdir(data_folder_path)) if ".DS" not in filename]
+            model_paths = OrderedDict([(filename, []) for filename in filenames])
             if os.path.exists(model_folder_path):
                 for filename in os.listdir(model_folder_path):
                     if ".DS" in filename:
                         continue
 
                     try:
-                        source = source_map[os.path.splitext(os.path.splitext(filename)[0])[0]]
+                        paths = model_paths[os.path.splitext(os.path.splitext(filename)[0])[0]]
                     except:
-                        source = source_map[filename]
+                        paths = model_paths[filename]
+                    paths.append(os.path.join(model_folder_path, filename))
 
-                    extension = os.path.splitext(filename)[1]
-                    if extension == ".json":
-                        source.read_semantic_type_json(os.path.join(model_folder_path, filename))
-                    else:
-                        print(source)
-                        source.read_semantic_type_from_gold(os.path.join(model_folder_path, filename))
+            file_paths = [os.path.join(data_folder_path, filename) for filename in filenames]
+            is_full = ["full" in data_folder_path] * len(filenames)
+            start_time = time.time()
+            if utils.ingestion_workers == 1 or len(filenames) < 2:
+                results = list(map(read_data_source, file_paths, is_full, model_paths.values()))
+            else:
+                with ProcessPoolExecutor(max_workers=utils.ingestion_workers) as pool:
+                    results = list(pool.map(read_data_source, file_paths, is_full, model_paths.values()))
+            logging.info("   {} files read in {:.3f}s, {} from the profile cache".format(
+                len(filenames), time.time() - start_time, sum([cached for _, _, cached in results])))
+
+            self.ingestion_times[folder_name] = OrderedDict()
+            for filename, (source, running_time, cached) in zip(filenames, results):
+                logging.info("   ...file: {} {} in {:.3f}s".format(
+                    filename, "loaded from the profile cache" if cached else "read", running_time))
+                print(filename)
+                source_map[filename] = source
+                self.ingestion_times[folder_name][filename] = running_time
 
             self.dataset_map[folder_name] = source_map
 
+    def memory_usage(self, folder_names=None):
+        """
+        Approximate memory held by the data sources read in by the labeler.
+        :param folder_names: Folders to report, defaults to all folders in dataset_map.
+        :return: Map from folder name to a map from file name to bytes, each with the sum under "total".
+        """
+        usage = {}
+        for folder_name in folder_names or self.dataset_map.keys():
+            folder_usage = {}
+            for filename, source in self.dataset_map[folder_name].items():
+                folder_usage[filename] = source.memory_usage()["total"]
+            folder_usage["total"] = sum(folder_usage.values())
+            usage[folder_name] = folder_usage
+        return usage
+
     def write_data_sources(self, limit=500, filter_unknown=False):
         logging.info("Writing available sources from semantic_labeler")
         for folder_name, source_map in self.dataset_map.items():
@@ -96,17 +161,26 @@ class SemanticLabeler:
         logging.info("Training random forest on {} datasets.".format(len(data_sets)))
         self.random_forest = MyRandomForest(data_sets, self.dataset_map)
         self.random_forest.train(train_sizes)
+        save_feature_cache()
 
     def train_semantic_types(self, dataset_list):
         logging.info("Training semantic types on {} datasets.".format(len(dataset_list)))
-        for name in dataset_list:
-            logging.info("   training semantic types on {} ".format(name))
-            index_config = {'name': re.sub(not_allowed_chars, "!", name)}
-            indexer.init_analyzers(index_config)
-            source_map = self.dataset_map[name]
-            for source in source_map.values():
-                # source = source_map[source_map.keys()[idx]]
-                source.save(index_config={'name': re.sub(not_allowed_chars, "!", name)})
+        indexer = get_indexer()
+        index_configs = []
+        try:
+            for name in dataset_list:
+                logging.info("   training semantic types on {} ".format(name))
+                index_config = {'name': re.sub(not_allowed_chars, "!", name)}
+                indexer.init_analyzers(index_config)
+                # refreshed once all datasets are indexed
+                indexer.defer_refresh(index_config)
+                index_configs.append(index_config)
+                indexer.index_sources(self.dataset_map[name].values(), index_config)
+        finally:
+            for index_config in index_configs:
+                indexer.refresh(index_config)
+        logging.info("Indexing throughput: {docs_per_second:.1f} docs/s, {bytes_per_second:.0f} bytes/s".format(
+            **indexer.get_throughput()))
 
     def predict_semantic_type_for_column(self, column):
         logging.info("Predicting semantic type for column: {}.".format(column))
@@ -114,6 +188,7 @@ class SemanticLabeler:
             logging.error("Prediction not possible. Model not trained.")
             raise Exception("Prediction not possible. Model not trained.")
 
+        searcher = get_searcher()
         start_time = time.time()
         # source_name = ""
         # if column.source_name:
@@ -171,6 +246,7 @@ class SemanticLabeler:
             logging.error("Prediction not possible: folder is not indexed by semantic labeler.")
             raise Exception("Prediction not possible: folder is not indexed by semantic labeler.")
 
+        searcher = get_searcher()
         result = []
         source_map = self.dataset_map[folder_name]
         start_time = time.time()
@@ -179,6 +255,15 @@ class SemanticLabeler:
             # we need to index the source
             index_config = {'name': source.index_name}
             source.save(index_config)
+            get_indexer().refresh(index_config)
+        # the similar text of all columns in the folder is searched in one request
+        textual_train_maps = searcher.search_similar_text_data_batch(
+            [({'name': source.index_name}, column.value_text, [])
+             for source in source_map.values() for column in source.column_map.values()])
+        textual_train_maps.reverse()
+
+        for source in source_map.values():
+            index_config = {'name': source.index_name}
             for column in source.column_map.values():
                 cur_res = {'source_name': source.name,
                            'column_name': column.name,
@@ -187,7 +272,7 @@ class SemanticLabeler:
                            }
 
                 train_examples_map = searcher.search_types_data(index_config, [])
-                textual_train_map = searcher.search_similar_text_data(index_config, column.value_text, [])
+                textual_train_map = textual_train_maps.pop()
                 try:
                     semantic_types = column.predict_type(train_examples_map, textual_train_map, self.random_forest)
                     logging.info("Column <{}> predicted semantic types {}".format(column.name, semantic_types))
@@ -207,10 +292,13 @@ class SemanticLabeler:
 
                 result.append(cur_res)
         running_time = time.time() - start_time
+        save_feature_cache()
         return {"folder_name": folder_name, "running_time": running_time, "predictions": result}
 
     def test_semantic_types(self, data_set, test_sizes):
         logging.info("Testing semantic types.")
+        searcher = get_searcher()
+        file_write = get_debug_file()
         rank_score_map = defaultdict(lambda: defaultdict(lambda: 0))
         count_map = defaultdict(lambda: defaultdict(lambda: 0))
 
@@ -225,40 +313,41 @@ class SemanticLabeler:
                 train_names = [source.index_name for source in double_name_list[idx + 1: idx + size + 1]]
                 train_examples_map = searcher.search_types_data(index_config, train_names)
                 source = source_map[source_name]
+                columns = [column for column in source.column_map.values() if column.semantic_type]
+                textual_train_maps = searcher.search_similar_text_data_batch(
+                    [(index_config, column.value_text, train_names) for column in columns])
 
-                for column in source.column_map.values():
-                    if column.semantic_type:
-                        textual_train_map = searcher.search_similar_text_data(index_config, column.value_text,
-                                                                              train_names)
-                        semantic_types = column.predict_type(train_examples_map, textual_train_map, self.random_forest)
-                        logging.debug("    semantic types: {}".format(semantic_types))
-
-                        for threshold in [0.01]:
-                            found = False
-                            rank = 1
-                            rank_score = 0
-                            for prediction in semantic_types:
-                                if column.semantic_type in prediction[1]:
-                                    if prediction[0] > threshold and prediction[0] != 0:
-                                        rank_score = 1.0 / (rank)
-                                    found = True
-                                    break
-                                if prediction[0] != 0:
-                                    rank += len(prediction[1])
-
-                            if not found and semantic_types[0][0] < threshold:
-                                rank_score = 1
-                            file_write.write(
-                                column.name + "\t" + column.semantic_type + "\t" + str(semantic_types) + "\n")
-                            file_write.write(str(rank_score) + "\n")
-                            rank_score_map[size][threshold] += rank_score
-                            count_map[size][threshold] += 1
+                for column, textual_train_map in zip(columns, textual_train_maps):
+                    semantic_types = column.predict_type(train_examples_map, textual_train_map, self.random_forest)
+                    logging.debug("    semantic types: {}".format(semantic_types))
+
+                    for threshold in [0.01]:
+                        found = False
+                        rank = 1
+                        rank_score = 0
+                        for prediction in semantic_types:
+                            if column.semantic_type in prediction[1]:
+                                if prediction[0] > threshold and prediction[0] != 0:
+                                    rank_score = 1.0 / (rank)
+                                found = True
+                                break
+                            if prediction[0] != 0:
+                                rank += len(prediction[1])
+
+                        if not found and semantic_types[0][0] < threshold:
+                            rank_score = 1
+                        file_write.write(
+                            column.name + "\t" + column.semantic_type + "\t" + str(semantic_types) + "\n")
+                        file_write.write(str(rank_score) + "\n")
+                        rank_score_map[size][threshold] += rank_score
+                        count_map[size][threshold] += 1
             running_time = time.time() - start_time
             for threshold in [0.01]:
                 file_write.write(
                     "Size: " + str(size) + " F-measure: " + str(
                         rank_score_map[size][threshold] * 1.0 / count_map[size][threshold]) + " Time: " + str(
                         running_time) + " Count: " + str(count_map[size][threshold]) + "\n")
+        save_feature_cache()
 
     def read_class_type_from_csv(self, file_path):
         self.file_class_map = {}
@@ -269,6 +358,8 @@ class SemanticLabeler:
 
     def test_semantic_types_from_2_sets(self, train_set, test_set):
         self.read_class_type_from_csv("data/datasets/%s/classes.csv" % test_set)
+        searcher = get_searcher()
+        file_write = get_debug_file()
         print(self.file_class_map.keys())
         rank_score_map = defaultdict(lambda: 0)
         count_map = defaultdict(lambda: 0)
@@ -284,13 +375,11 @@ class SemanticLabeler:
             source = self.dataset_map[test_set][source_name]
 
             column_result_map = {}
-            for column in source.column_map.values():
-
-                if not column.semantic_type or not column.value_list or "ontology" not in column.semantic_type:
-                    continue
-
-                textual_train_map = searcher.search_similar_text_data(train_index_config, column.value_text,
-                                                                      [self.file_class_map[source_name]])
+            columns = [column for column in source.column_map.values()
+                       if column.semantic_type and column.value_list and "ontology" in column.semantic_type]
+            textual_train_maps = searcher.search_similar_text_data_batch(
+                [(train_index_config, column.value_text, [self.file_class_map[source_name]]) for column in columns])
+            for column, textual_train_map in zip(columns, textual_train_maps):
 
                 semantic_types = column.predict_type(train_examples_map, textual_train_map, self.random_forest)
 
@@ -326,4 +415,5 @@ class SemanticLabeler:
                 " MRR: " + str(
                     rank_score_map[threshold] * 1.0 / count_map[threshold]) + " Count: " + str(
                     count_map[threshold]) + "\n")
+        save_feature_cache()
         return source_result_map
@@ -0,0 +1,345 @@
+from collections import Counter
+import json
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+
+from lib import utils
+from lib.utils import get_index_name, match_index
+
+__author__ = "minh"
+
+# the textual analyzer of search.indexer: standard tokens, lowercased, without the english stop words of lucene
+token_pattern = re.compile(r"\w+", re.UNICODE)
+stop_words = {"a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no",
+              "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to",
+              "was", "will", "with"}
+# parameters of the BM25 similarity, the defaults of elasticsearch
+bm25_k1 = 1.2
+bm25_b = 0.75
+
+
+def get_tokens(text):
+    if not text:
+        return []
+    return [token for token in token_pattern.findall(text.lower()) if token not in stop_words]
+
+
+class EmbeddedIndex:
+    """
+    In-process replacement of the elasticsearch cluster: keeps the indexed columns and an inverted index
+    of their textual field. Every change is appended to a log next to the pickle file of the index,
+    which is rewritten from memory on save and once the log outgrows it.
+    Documents are returned in the shape of elasticsearch hits.
+    """
+    # attributes which are not part of the persisted state
+    transient_keys = {"path", "log_file", "snapshot_size", "replaying", "lock"}
+
+    def __init__(self, path=None):
+        self.path = path
+        self.indices = set()
+        # document id -> hit with _index, _type, _id and _source
+        self.docs = {}
+        # term -> document id -> term frequency in the textual field
+        self.postings = {}
+        self.doc_lengths = {}
+        self.next_id = 0
+        # changes with every added or removed document
+        self.generation = 0
+        # changes with every save, the log starts with the id of the saved index it applies to
+        self.log_id = 0
+        self.log_file = None
+        self.snapshot_size = 0
+        self.replaying = False
+        # documents are added by the requests indexing sources while other requests search them
+        self.lock = threading.RLock()
+        if path:
+            self.load()
+
+    def get_log_path(self):
+        return self.path + ".log"
+
+    def load(self):
+        if os.path.exists(self.path):
+            logging.info("Loading embedded index from {}".format(self.path))
+            with open(self.path, "rb") as f:
+                self.__dict__.update(pickle.load(f))
+            self.snapshot_size = os.path.getsize(self.path)
+        if not os.path.exists(self.get_log_path()):
+            return
+        count = 0
+        is_intact = True
+        self.replaying = True
+        with open(self.get_log_path(), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            try:
+                log_id = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                log_id = None
+            # otherwise the index was saved after the log was written, but the log was not removed
+            is_intact = log_id == self.log_id
+            while is_intact and f.tell() < size:
+                try:
+                    change = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):
+                    # the last change was cut short by a crash
+                    logging.warning("Ignoring truncated change in {}".format(self.get_log_path()))
+                    is_intact = False
+                    break
+                getattr(self, change[0])(*change[1:])
+                count += 1
+        self.replaying = False
+        logging.info("Replayed {} changes from {}".format(count, self.get_log_path()))
+        if not is_intact:
+            # changes cannot be appended after a stale or truncated log
+            self.save()
+
+    def save(self):
+        """
+        Write the whole index to its pickle file and truncate the log of changes.
+        """
+        with self.lock:
+            if not self.path:
+                return
+            self.log_id += 1
+            state = dict([(key, value) for key, value in self.__dict__.items() if key not in self.transient_keys])
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self.snapshot_size = os.path.getsize(self.path)
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            if os.path.exists(self.get_log_path()):
+                os.remove(self.get_log_path())
+
+    def log_change(self, *change):
+        """
+        Append a change, the name of the method making it and its arguments, to the log.
+        """
+        with self.lock:
+            if not self.path or self.replaying:
+                return
+            if self.log_file is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory, exist_ok=True)
+                self.log_file = open(self.get_log_path(), "ab")
+                if not self.log_file.tell():
+                    pickle.dump(self.log_id, self.log_file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(change, self.log_file, pickle.HIGHEST_PROTOCOL)
+            self.log_file.flush()
+            # replaying a log longer than the index costs more than rewriting the index
+            if self.log_file.tell() > max(self.snapshot_size, 2 ** 20):
+                self.save()
+
+    def create(self, index_name):
+        with self.lock:
+            if index_name not in self.indices:
+                self.indices.add(index_name)
+                self.log_change("create", index_name)
+
+    def exists(self, index_pattern):
+        with self.lock:
+            return any([match_index(index_pattern, index_name) for index_name in self.indices])
+
+    def add(self, index_name, doc_type, body):
+        with self.lock:
+            doc_id = self.next_id
+            self.next_id += 1
+            self.generation += 1
+            self.indices.add(index_name)
+            self.docs[doc_id] = {"_index": index_name, "_type": doc_type, "_id": str(doc_id), "_source": body}
+            tokens = Counter(get_tokens(body.get("textual")))
+            for term, count in tokens.items():
+                self.postings.setdefault(term, {})[doc_id] = count
+            self.doc_lengths[doc_id] = sum(tokens.values())
+            self.log_change("add", index_name, doc_type, body)
+            return self.docs[doc_id]
+
+    def remove(self, doc_id):
+        with self.lock:
+            hit = self.docs.pop(doc_id)
+            self.generation += 1
+            for term in set(get_tokens(hit["_source"].get("textual"))):
+                postings = self.postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self.postings[term]
+            del self.doc_lengths[doc_id]
+
+    def delete(self, index_pattern):
+        with self.lock:
+            for doc_id in [doc_id for doc_id, hit in self.docs.items() if match_index(index_pattern, hit["_index"])]:
+                self.remove(doc_id)
+            self.indices = set([index_name for index_name in self.indices
+                                if not match_index(index_pattern, index_name)])
+            self.log_change("delete", index_pattern)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.indices = set()
+            self.docs = {}
+            self.postings = {}
+            self.doc_lengths = {}
+            self.log_change("clear")
+
+    def get_filter(self, index_pattern, doc_types):
+        matches = {}
+
+        def is_match(hit):
+            if doc_types and hit["_type"] not in doc_types:
+                return False
+            if hit["_index"] not in matches:
+                matches[hit["_index"]] = match_index(index_pattern, hit["_index"])
+            return matches[hit["_index"]]
+        return is_match
+
+    def scan(self, index_pattern, doc_types):
+        """
+        :return: Copies of the hits of the matching documents, callers may modify them.
+        """
+        with self.lock:
+            is_match = self.get_filter(index_pattern, doc_types)
+            return [dict(hit, _source=dict(hit["_source"])) for hit in self.docs.values() if is_match(hit)]
+
+    def match(self, index_pattern, doc_types, text, size):
+        """
+        Rank the documents by the BM25 score of their textual field against the text,
+        like a match query of elasticsearch which ors the terms of the text.
+        """
+        with self.lock:
+            is_match = self.get_filter(index_pattern, doc_types)
+            num_docs = len(self.docs)
+            avg_length = sum(self.doc_lengths.values()) * 1.0 / num_docs if num_docs else 0
+            scores = Counter()
+            for term, query_count in Counter(get_tokens(text)).items():
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, count in postings.items():
+                    if not is_match(self.docs[doc_id]):
+                        continue
+                    norm = bm25_k1 * (1 - bm25_b + bm25_b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += query_count * idf * count * (bm25_k1 + 1) / (count + norm)
+            hits = [dict(self.docs[doc_id], _source=dict(self.docs[doc_id]["_source"]), _score=score)
+                    for doc_id, score in scores.most_common(size)]
+            return {"hits": {"total": len(scores), "max_score": hits[0]["_score"] if hits else None, "hits": hits}}
+
+
+class EmbeddedIndexer:
+    """
+    Indexer on an EmbeddedIndex, with the methods of search.indexer.Indexer.
+    """
+    def __init__(self, index):
+        self.index = index
+        # indices loaded in bulk, whose changes are compacted into the index file on refresh
+        self.deferred = set()
+        self.stats = {"docs": 0, "bytes": 0, "seconds": 0.0}
+
+    def init_analyzers(self, index_config):
+        logging.info("Initializing analyzers")
+        self.index.create(get_index_name(index_config))
+
+    def index_source(self, source, index_config):
+        logging.info("Indexing source: {}".format(source.name))
+        self.index_sources([source], index_config)
+
+    def index_sources(self, sources, index_config):
+        index_name = get_index_name(index_config)
+        stats = {"docs": 0, "bytes": 0}
+        start_time = time.time()
+        for source in sources:
+            for column in source.column_map.values():
+                if column.semantic_type:
+                    logging.info("Indexing column " + str(column))
+                    body = column.to_json()
+                    body['source'] = source.index_name
+                    # stored as elasticsearch would return it
+                    document = json.dumps(body)
+                    self.index.add(index_name, source.index_name, json.loads(document))
+                    stats["docs"] += 1
+                    stats["bytes"] += len(document.encode("utf-8"))
+        stats["seconds"] = time.time() - start_time
+        for key in stats:
+            self.stats[key] += stats[key]
+        logging.info("Indexed {} documents ({} bytes) into {} in {:.3f}s".format(
+            stats["docs"], stats["bytes"], index_name, stats["seconds"]))
+        return stats
+
+    def get_throughput(self):
+        seconds = self.stats["seconds"] or 1
+        return {"docs_per_second": self.stats["docs"] / seconds, "bytes_per_second": self.stats["bytes"] / seconds}
+
+    def defer_refresh(self, index_config):
+        self.deferred.add(get_index_name(index_config))
+
+    def refresh(self, index_config):
+        # changes to other indices are only logged, the log is compacted once it outgrows the index file
+        if get_index_name(index_config) in self.deferred:
+            self.deferred.discard(get_index_name(index_config))
+            self.index.save()
+
+    def delete_column(self, index_config):
+        logging.info("Deleting index for column")
+        if self.index.exists(get_index_name(index_config)):
+            self.index.delete(get_index_name(index_config))
+            return True
+        return False
+
+    def clean(self):
+        logging.info("Cleaning embedded indexer")
+        self.index.clear()
+        # nothing is left to replay
+        self.index.save()
+        return True
+
+
+class EmbeddedSearcher:
+    """
+    Searcher on an EmbeddedIndex, with the methods of search.searcher.Searcher.
+    """
+    def __init__(self, index, get_type_profiles):
+        """
+        :param index: EmbeddedIndex to search.
+        :param get_type_profiles: Function merging training documents into profiles of their semantic types.
+        """
+        self.index = index
+        self.get_type_profiles = get_type_profiles
+        # index pattern -> (generation of the index, profiles of its semantic types)
+        self.type_profiles = {}
+
+    def search_columns_data(self, index_config, source_names):
+        return self.index.scan(get_index_name(index_config), source_names)
+
+    def search_similar_text_data(self, index_config, value_text, source_names):
+        return self.index.match(get_index_name(index_config), source_names, value_text, 10)
+
+    def search_similar_text_data_batch(self, queries):
+        return [self.search_similar_text_data(*query) for query in queries]
+
+    def search_types_data(self, index_config, source_names):
+        with self.index.lock:
+            hits = self.search_columns_data(index_config, source_names)
+            index_generation = self.index.generation
+        if utils.is_column_based:
+            return hits
+        if source_names:
+            type_profiles = self.get_type_profiles(hits)
+        else:
+            index_name = get_index_name(index_config)
+            generation, type_profiles = self.type_profiles.get(index_name, (None, None))
+            if generation != index_generation:
+                type_profiles = self.get_type_profiles(hits)
+                self.type_profiles[index_name] = (index_generation, type_profiles)
+        return [{"_source": profile} for profile in type_profiles.values()]
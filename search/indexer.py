@@ -1,15 +1,76 @@
+from collections import deque
+import json
+import time
+
+from elasticsearch.helpers import streaming_bulk, parallel_bulk
+
+from lib import utils
 from lib.utils import get_index_name
 import logging
 __author__ = "minh"
 
+# only the textual field is searched, the other fields of the columns are kept in _source only
+stored_keyword = {"type": "keyword", "index": False, "doc_values": False}
+stored_double = {"type": "double", "index": False, "doc_values": False}
+stored_long = {"type": "long", "index": False, "doc_values": False}
+column_mapping = {
+    "properties": {
+        "textual": {"type": "text", "analyzer": "textual"},
+        "semantic_type": {"type": "keyword"},
+        "source": {"type": "keyword"},
+        "name": {"type": "keyword"},
+        "fingerprints": {"type": "object", "enabled": False},
+        "values": stored_keyword,
+        "textual_list": stored_keyword,
+        "textual_set": stored_keyword,
+        "name_bigrams": stored_keyword,
+        "textual_minhash": stored_long,
+        "is_numeric": stored_double,
+        "numeric_list": stored_double,
+        "sorted_numeric_list": stored_double,
+        "numeric_quartiles": stored_double,
+        "sample_list": stored_double,
+        "word2vec": stored_double,
+        "histogram": stored_long,
+        "char_lengths": stored_long,
+        "word_lengths": stored_long
+    },
+    "dynamic_templates": [
+        {"stored_strings": {"match_mapping_type": "string", "mapping": stored_keyword}},
+        {"stored_doubles": {"match_mapping_type": "double", "mapping": stored_double}},
+        {"stored_longs": {"match_mapping_type": "long", "mapping": stored_long}}
+    ]
+}
+# the sources of an index are its mapping types, elasticsearch 6 allows a single type per index and 7 none,
+# and the _default_ mapping, the text and keyword types and the standard token filter need elasticsearch 5
+supported_es_version = 5
+
 
 class Indexer:
-    def __init__(self, es):
+    def __init__(self, es, searcher=None):
         # logging.info("Initializing indexer")
         self.es = es
+        # searcher whose snapshots follow the changes made by the indexer
+        self.searcher = searcher
+        # totals over all bulk requests, see get_throughput
+        self.stats = {"docs": 0, "bytes": 0, "seconds": 0.0}
+        self.is_version_checked = False
+
+    def check_version(self):
+        """
+        Fail before creating an index on an elasticsearch cluster which cannot hold it.
+        """
+        if self.is_version_checked:
+            return
+        version = self.es.info()["version"]["number"]
+        if int(version.split(".")[0]) != supported_es_version:
+            raise Exception("Elasticsearch {} is not supported, the indices need elasticsearch {}.x "
+                            "(one mapping type per source), see the README".format(version, supported_es_version))
+        self.is_version_checked = True
 
     def init_analyzers(self, index_config):
         logging.info("Initializing analyzers")
+        self.check_version()
         self.es.indices.create(index=get_index_name(index_config), body={
             "settings": {
                 "analysis": {
@@ -43,17 +104,13 @@ class Indexer:
                         }
                     }
                 }
+            },
+            "mappings": {
+                "_default_": column_mapping
             }
         })
         logging.debug("Done: Initializing analyzers")
 
-    def index_column(self, column, source_name, index_config):
-        logging.info("Indexing column " + str(column))
-        body = column.to_json()
-        body['source'] = source_name
-        self.es.index(index=get_index_name(index_config), doc_type=source_name,
-                          body=body)
-
     def index_source(self, source, index_config):
         logging.info("Indexing source: {}".format(source.name))
         # self.es.indices.put_mapping(index=get_index_name(index_config), doc_type=source.index_name, body={
@@ -71,14 +128,79 @@ class Indexer:
         #     }
         # })
 
-        for column in source.column_map.values():
-            if column.semantic_type:
-                self.index_column(column, source.index_name, index_config)
+        self.index_sources([source], index_config)
+
+    def index_sources(self, sources, index_config):
+        """
+        Index the labeled columns of the sources with the bulk api.
+        :param sources: Sources to index.
+        :param index_config: Index to write to.
+        :return: Number of indexed documents, their size in bytes and the seconds spent.
+        """
+        index_name = get_index_name(index_config)
+        if not self.es.indices.exists(index=index_name):
+            # indices created by the first document would get a dynamic mapping
+            self.init_analyzers(index_config)
+        stats = {"docs": 0, "bytes": 0}
+        documents = deque()
+        actions = self.get_actions(sources, index_name, stats, documents)
+        start_time = time.time()
+        if utils.bulk_thread_count == 1:
+            results = streaming_bulk(self.es, actions, chunk_size=utils.bulk_chunk_size)
+        else:
+            results = parallel_bulk(self.es, actions, thread_count=utils.bulk_thread_count,
+                                    chunk_size=utils.bulk_chunk_size)
+        hits = []
+        for _, item in results:
+            stats["docs"] += 1
+            doc_type, document = documents.popleft()
+            if self.searcher:
+                hits.append({"_index": index_name, "_type": doc_type, "_id": item["index"]["_id"],
+                             "_source": json.loads(document)})
+        if hits:
+            self.searcher.add_to_snapshots(hits)
+        stats["seconds"] = time.time() - start_time
+        for key in stats:
+            self.stats[key] += stats[key]
+        logging.info("Indexed {} documents ({} bytes) into {} in {:.3f}s".format(
+            stats["docs"], stats["bytes"], index_name, stats["seconds"]))
+        return stats
+
+    def get_actions(self, sources, index_name, stats, documents):
+        for source in sources:
+            for column in source.column_map.values():
+                if column.semantic_type:
+                    logging.info("Indexing column " + str(column))
+                    body = column.to_json()
+                    body['source'] = source.index_name
+                    # serialized once here so that the size of the request is known
+                    document = self.es.transport.serializer.dumps(body)
+                    stats["bytes"] += len(document.encode("utf-8"))
+                    documents.append((source.index_name, document))
+                    yield {"_index": index_name, "_type": source.index_name, "_source": document}
+
+    def get_throughput(self):
+        """
+        :return: Documents and bytes indexed per second over all bulk requests of the indexer.
+        """
+        seconds = self.stats["seconds"] or 1
+        return {"docs_per_second": self.stats["docs"] / seconds, "bytes_per_second": self.stats["bytes"] / seconds}
+
+    def defer_refresh(self, index_config):
+        # nothing becomes searchable in the index until refresh is called
+        self.es.indices.put_settings(index=get_index_name(index_config), body={"index": {"refresh_interval": "-1"}})
+
+    def refresh(self, index_config):
+        index_name = get_index_name(index_config)
+        self.es.indices.put_settings(index=index_name, body={"index": {"refresh_interval": None}})
+        self.es.indices.refresh(index=index_name)
 
     def delete_column(self, index_config):
         logging.info("Deleting index for column")
         if self.es.indices.exists(get_index_name(index_config)):
             self.es.delete(index=get_index_name(index_config))
+            if self.searcher:
+                self.searcher.remove_from_snapshots(get_index_name(index_config))
             return True
         return False
 
@@ -87,6 +209,8 @@ class Indexer:
         try:
             # NOTE: dangerous!
             self.es.indices.delete(index='*', ignore=[400, 404])
+            if self.searcher:
+                self.searcher.clear_snapshots()
             return True
         except Exception as e:
             logging.error("Error occurred while cleaning index: {}".format(e))
@@ -1,19 +1,49 @@
 from elasticsearch.helpers import scan
 
-from lib.utils import get_index_name
+from lib import utils
+from lib.utils import get_index_name, match_index
 import logging
+import threading
 
 __author__ = "minh"
 
+# fields of the similar text hits read by get_test_results
+text_source_fields = ["semantic_type", "is_numeric"]
+
 
 class Searcher:
-    def __init__(self, es):
+    def __init__(self, es, get_source_fields, summary_fields, get_type_profiles):
+        """
+        :param es: Elasticsearch client.
+        :param get_source_fields: Function returning the fields of the training documents the features read.
+        :param summary_fields: Fields derived from other fields of a document, missing from old documents.
+        :param get_type_profiles: Function merging training documents into profiles of their semantic types.
+        """
         self.es = es
+        self.get_source_fields = get_source_fields
+        self.summary_fields = summary_fields
+        self.get_type_profiles = get_type_profiles
+        # process-local snapshots of the training columns by index pattern, kept up to date by the indexer
+        self.snapshots = {}
+        # profiles of the semantic types in the snapshots by index pattern, when utils.is_column_based is False
+        self.type_profiles = {}
+        # the snapshots are loaded and updated by the threads serving requests and by the indexer
+        self.lock = threading.RLock()
 
     def search_columns_data(self, index_config, source_names):
+        fields = self.get_source_fields()
         result = list(scan(self.es, index=get_index_name(index_config), doc_type=','.join(source_names),
-                           query={"query": {"match_all": {}}}))
+                           query={"query": {"match_all": {}}, "_source": fields}))
 
+        # documents indexed before the summaries were stored are read in full, the summaries are derived from them
+        summaries = [field for field in fields if field in self.summary_fields]
+        old_hits = [hit for hit in result if not any([field in hit["_source"] for field in summaries])]
+        if summaries and old_hits:
+            docs = self.es.mget(body={"docs": [{"_index": hit["_index"], "_type": hit["_type"], "_id": hit["_id"]}
+                                               for hit in old_hits]})["docs"]
+            for hit, doc in zip(old_hits, docs):
+                if doc.get("found"):
+                    hit["_source"] = doc["_source"]
         return result
 
     def search_similar_text_data(self, index_config, value_text, source_names):
@@ -25,7 +55,8 @@ class Searcher:
                                             "match": {
                                                 "textual": text,
                                             }
-                                        }
+                                        },
+                                        "_source": text_source_fields
                                     },
                                     size=10)
         except Exception as e:
@@ -33,5 +64,95 @@ class Searcher:
             result = {"hits": {"hits": []}}
         return result
 
+    def search_similar_text_data_batch(self, queries):
+        """
+        Run the searches of search_similar_text_data in msearch requests of at most utils.msearch_batch_size searches.
+        A search that fails gets no hits, like in search_similar_text_data.
+        :param queries: List of (index_config, value_text, source_names).
+        :return: List of search results in the order of queries.
+        """
+        results = []
+        batch_size = utils.msearch_batch_size or len(queries) or 1
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            body = []
+            for index_config, value_text, source_names in batch:
+                header = {}
+                if get_index_name(index_config):
+                    header["index"] = get_index_name(index_config)
+                if source_names:
+                    header["type"] = ','.join(source_names)
+                body.append(header)
+                body.append({"query": {"match": {"textual": value_text}}, "_source": text_source_fields, "size": 10})
+            try:
+                responses = self.es.msearch(body=body)["responses"]
+            except Exception as e:
+                logging.warning("Batched search of similar text data not possible, searching one by one: {}".format(e))
+                results.extend([self.search_similar_text_data(*query) for query in batch])
+                continue
+            for response in responses:
+                if "error" in response:
+                    logging.warning("Search similar text data not possible")
+                    response = {"hits": {"hits": []}}
+                results.append(response)
+        return results
+
+    def load_snapshot(self, index_config):
+        index_name = get_index_name(index_config)
+        logging.info("Loading snapshot of index '{}'".format(index_name))
+        # documents indexed since the last refresh would be missing from the snapshot for good
+        self.es.indices.refresh(index=index_name or "_all")
+        self.snapshots[index_name] = self.search_columns_data(index_config, [])
+
     def search_types_data(self, index_config, source_names):
-        return self.search_columns_data(index_config, source_names)
+        """
+        Training columns of the index, or the profiles of their semantic types, served from the snapshot.
+        The hits are shared by all callers and with the snapshot, they must not be modified.
+        """
+        index_name = get_index_name(index_config)
+        with self.lock:
+            if index_name not in self.snapshots:
+                self.load_snapshot(index_config)
+            if not source_names:
+                hits = list(self.snapshots[index_name])
+            else:
+                hits = [hit for hit in self.snapshots[index_name] if hit["_type"] in source_names]
+            if utils.is_column_based:
+                return hits
+            # only the profiles of whole indices are kept, training asks for many different subsets of the sources
+            if source_names:
+                type_profiles = self.get_type_profiles(hits)
+            else:
+                if index_name not in self.type_profiles:
+                    self.type_profiles[index_name] = self.get_type_profiles(hits)
+                type_profiles = self.type_profiles[index_name]
+            return [{"_source": profile} for profile in type_profiles.values()]
+
+    def add_to_snapshots(self, hits):
+        """
+        Add newly indexed documents to the snapshots of the index patterns matching their index.
+        """
+        fields = self.get_source_fields()
+        hits = [dict(hit, _source=dict([(field, hit["_source"][field]) for field in fields if field in hit["_source"]]))
+                for hit in hits]
+        with self.lock:
+            for index_pattern, snapshot in self.snapshots.items():
+                snapshot.extend([hit for hit in hits if match_index(index_pattern, hit["_index"])])
+            for index_pattern, type_profiles in self.type_profiles.items():
+                self.get_type_profiles([hit for hit in hits if match_index(index_pattern, hit["_index"])], type_profiles)
+
+    def remove_from_snapshots(self, index_pattern):
+        """
+        Drop the documents of deleted indices from the snapshots.
+        """
+        with self.lock:
+            for index_name in self.snapshots:
+                self.snapshots[index_name] = [hit for hit in self.snapshots[index_name]
+                                              if not match_index(index_pattern, hit["_index"])]
+            # profiles cannot be unmerged, they are rebuilt on the next search
+            self.type_profiles = {}
+
+    def clear_snapshots(self):
+        with self.lock:
+            self.snapshots = {}
+            self.type_profiles = {}
@@ -3,13 +3,14 @@ from flask import make_response
 from flask import jsonify
 import json
 
-from lib import indexer
+from lib import get_indexer
 from lib.column import Column
 from lib.source import Source
 from lib.utils import get_new_index_name
 from main.semantic_labeler import SemanticLabeler
 
 import logging
+import logging.handlers
 import os
 from shutil import copyfile
 
@@ -169,7 +170,7 @@ def add_semantic_type(column=None, semantic_type=None):
 def delete_semantic_type():
     semantic_type = request.json["semantic_type"]
     _id = get_new_index_name(semantic_type, "*")
-    if not indexer.delete_column(index_config={"name": _id, "size": 0}):
+    if not get_indexer().delete_column(index_config={"name": _id, "size": 0}):
         logging.error("Unable to delete semantic type.")
         return error("Unable to delete semantic type.")
     resp = jsonify("Deleted semantic type " + str(semantic_type))
@@ -197,7 +198,7 @@ def delete_column():
     semantic_type = request.json["semantic_type"]
     column_name = request.json["column_name"]
     _id = get_new_index_name(semantic_type, column_name)
-    if not indexer.delete_column(index_config={"name": _id, "size": 0}):
+    if not get_indexer().delete_column(index_config={"name": _id, "size": 0}):
         logging.error("Unable to delete semantic type.")
         return error("Unable to delete semantic type.")
     resp = jsonify("Column deleted: " + str(column_name))
@@ -224,10 +225,7 @@ def get_semantic_type():
 
     try:
         column = Column(header, source)
-        for element in values:
-            # logging.debug("Add element: {}".format(element))
-            # logging.debug("column: {}".format(column))
-            column.add_value(element)
+        column.add_values(values)
 
         result = semantic_labeler.predict_semantic_type_for_column(column)
         resp = jsonify(result)
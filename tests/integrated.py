@@ -1,9 +1,13 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, Counter
+from functools import partial
+import heapq
 
+from lib import utils
+from lib.executor import map_values
+from lib.feature_cache import get_feature_cache, get_fingerprints, merge_fingerprints
 from lib.utils import is_column_based, is_tree_based
-from main import sc
 from .numeric import *
-from tests.label import label_text_test
+from tests.label import label_bigram_test, batch_label_bigram_test, get_name_bigrams
 from tests.textual import *
 
 import logging
@@ -28,61 +32,342 @@ W_TEST = "WELCH"
 JACCARD_TEST = "JACCARD"
 
 feature_tests_map = {ANOVA_TEST: anova_test, KS_TEST: kolmogorov_smirnov_test, JACCARD_TEST: jaccard_test,
-                     LBL_TEST: label_text_test, COVER_TEST: coverage_test, ABBR_TEST: abbr_test, W_TEST: welch_test,
+                     LBL_TEST: label_bigram_test, COVER_TEST: quartile_coverage_test, ABBR_TEST: abbr_test, W_TEST: welch_test,
                      MW_NUM_TEST: mann_whitney_u_test, WORD2VEC_TEST: word2vec_cosine_test, MW_TEST: mann_whitney_test,
                      CHAR_LEN_TEST: char_len_test, STR_LEN_TEST: len_test}
 
-data_tests_map = {"textual_list": [JACCARD_TEST], "values": [ABBR_TEST], 'word2vec': [WORD2VEC_TEST],
-                  'numeric_list': [KS_TEST, COVER_TEST, W_TEST], "char_lengths": [CHAR_LEN_TEST],
-                  "word_lengths": [STR_LEN_TEST], "name": [LBL_TEST], "histogram": [MW_TEST]}
+# tests scoring a test column against the values of all training columns at once, in one vectorized pass
+batch_tests_map = {KS_TEST: batch_kolmogorov_smirnov_test, W_TEST: batch_welch_test,
+                   MW_NUM_TEST: batch_mann_whitney_u_test, MW_TEST: batch_mann_whitney_test,
+                   LBL_TEST: batch_label_bigram_test}
+
+# the tests read the summaries which Column.to_json precomputes at index time
+data_tests_map = {"textual_set": [JACCARD_TEST], "values": [ABBR_TEST], 'word2vec': [WORD2VEC_TEST],
+                  'numeric_list': [W_TEST], 'sorted_numeric_list': [KS_TEST], 'numeric_quartiles': [COVER_TEST],
+                  "char_lengths": [CHAR_LEN_TEST], "word_lengths": [STR_LEN_TEST], "name_bigrams": [LBL_TEST],
+                  "histogram": [MW_TEST]}
+
+# summaries missing in documents indexed before they were precomputed, by the field they are derived from
+summary_map = {"textual_set": ("textual_list", lambda values: list(set(values))),
+               "sorted_numeric_list": ("numeric_list", sorted),
+               "numeric_quartiles": ("numeric_list", get_quartiles),
+               "name_bigrams": ("name", get_name_bigrams),
+               "textual_minhash": ("textual_set", get_minhash)}
+
+# tests computed on the sketches of large training columns when utils.jaccard_error is set:
+# test -> (field of the values, field of their sketch, approximate test)
+sketch_tests_map = {JACCARD_TEST: ("textual_set", "textual_minhash", minhash_jaccard_test)}
 
 feature_list = [LBL_TEST, COVER_TEST, JACCARD_TEST, TF_IDF_TEST, KS_TEST, MW_TEST]
 text_list = [ABBR_TEST, JACCARD_TEST, TF_IDF_TEST]
 number_list = [COVER_TEST, KS_TEST, W_TEST]
 
+# tests whose result balance_result zeroes when one of the columns has no text or no numbers
+numeric_balanced_tests = {KS_TEST, W_TEST, MW_NUM_TEST, COVER_TEST}
+textual_balanced_tests = {JACCARD_TEST, ABBR_TEST}
+# tests which only run on the prefilter_top_k training columns
+expensive_tests = {KS_TEST, W_TEST, MW_NUM_TEST, MW_TEST, ANOVA_TEST, ABBR_TEST}
+# pair evaluations of get_test_results: run, short circuited because their result is 0 and pruned by prefilter_top_k
+prefilter_stats = Counter()
+
 tree_feature_list = []
 for feature in feature_list:
     for i in range(5):
         tree_feature_list.append(feature + str(i))
 
 
-def get_test_results(train_examples_map, textual_train_map, test_examples_map, is_labeled=False):
-    def zip_with_key(key, item_map):
-        result_list = []
-        for value in item_map.items():
-            if value[0] not in data_tests_map:
-                continue
-            for test_name in data_tests_map[value[0]]:
-                if test_name in feature_list:
-                    row = {'name': key,
-                           'data_type': value[0],
-                           'test_name': test_name,
-                           'values': value[1],
-                           'num': item_map['is_numeric']}
-                    result_list.append(row)
-        return result_list
+def get_source_fields():
+    """
+    Fields of the training documents read by get_test_results with the tests in feature_list,
+    the fields that are retrieved from the index.
+    """
+    fields = {"semantic_type", "is_numeric"}
+    for data_type, test_names in data_tests_map.items():
+        if set(test_names) & set(feature_list):
+            fields.add(data_type)
+    if utils.feature_cache_size:
+        fields.add("fingerprints")
+    if utils.jaccard_error is not None:
+        fields.update([sketch_tests_map[test_name][1] for test_name in sketch_tests_map if test_name in feature_list])
+    if not utils.is_column_based and "numeric_quartiles" in fields:
+        # the quartiles of a semantic type are recomputed from the numbers of its columns
+        fields.add("sorted_numeric_list")
+    return sorted(fields)
+
+
+def add_summaries(item_map):
+    fields = get_source_fields()
+    missing = [summary for summary, (field, _) in summary_map.items()
+               if summary not in item_map and field in item_map and summary in fields]
+    if not missing:
+        return item_map
+    item_map = dict(item_map)
+    for summary in missing:
+        field, summarize = summary_map[summary]
+        item_map[summary] = summarize(item_map[field])
+    return item_map
+
+
+def is_sketched(test_name, item_map):
+    """
+    Whether test_name compares the training column by its sketch: approximation is on, the column is larger
+    than utils.jaccard_exact_max_size and its sketch, like those of the test columns, has enough hashes.
+    """
+    if utils.jaccard_error is None or test_name not in sketch_tests_map:
+        return False
+    field, sketch_field, _ = sketch_tests_map[test_name]
+    size = get_minhash_size(utils.jaccard_error)
+    return (len(item_map.get(field) or []) > utils.jaccard_exact_max_size and
+            min(len(item_map.get(sketch_field) or []), utils.minhash_size or 0) >= size)
+
+
+def get_column_fingerprints(item_map):
+    """
+    Fingerprints of the fields of a column which the feature tests read, the keys of the feature cache.
+    :return: Map from field to fingerprint, None if the feature cache is disabled.
+    """
+    if not utils.feature_cache_size:
+        return None
+    fingerprints = item_map.get("fingerprints") or {}
+    fields = [field for field in get_source_fields() if field in data_tests_map or
+              field in [sketch_field for _, sketch_field, _ in sketch_tests_map.values()]]
+    # documents indexed without the cache or with other tests lack fingerprints of some fields
+    missing = [field for field in fields if field in item_map and field not in fingerprints]
+    if missing:
+        fingerprints = dict(fingerprints, **get_fingerprints(item_map, missing))
+    return fingerprints
+
+
+def zip_with_key(key, item_map):
+    result_list = []
+    item_map = add_summaries(item_map)
+    fingerprints = get_column_fingerprints(item_map) or {}
+    for value in item_map.items():
+        if value[0] not in data_tests_map:
+            continue
+        for test_name in data_tests_map[value[0]]:
+            if test_name in feature_list:
+                row = {'name': key,
+                       'data_type': value[0],
+                       'test_name': test_name,
+                       'values': value[1],
+                       'num': item_map['is_numeric']}
+                if is_sketched(test_name, item_map):
+                    row['data_type'] = sketch_tests_map[test_name][1]
+                    row['values'] = item_map[row['data_type']]
+                row['fingerprint'] = fingerprints.get(row['data_type'])
+                result_list.append(row)
+    return result_list
+
+
+def get_cache_key(row, test_examples_map, test_fingerprints):
+    """
+    Key of the result of a row in the feature cache: the test, the fingerprints of the field it reads
+    in both columns, their share of numbers and the settings which change the results of the tests.
+    :return: Key, None if a column has no fingerprint of the field.
+    """
+    test_fingerprint = test_fingerprints.get(row['data_type'])
+    if not row['fingerprint'] or not test_fingerprint:
+        return None
+    settings = (utils.jaccard_error, utils.minhash_size)
+    return (row['test_name'], row['data_type'], row['fingerprint'], row['num'], test_fingerprint,
+            test_examples_map['is_numeric'], settings)
+
+
+def get_feature_test(row):
+    if row['test_name'] in sketch_tests_map and row['data_type'] == sketch_tests_map[row['test_name']][1]:
+        return sketch_tests_map[row['test_name']][2]
+    return feature_tests_map[row['test_name']]
+
+
+def run_column_test(row, test_examples_map):
+    return ((row['name'], row['test_name']),
+            round(get_feature_test(row)(row['values'], test_examples_map[row['data_type']], row['num'],
+                                        test_examples_map['is_numeric']), 2))
+
 
+def run_batch_test(test_name, rows, test_examples_map):
+    data_type = rows[0]['data_type']
+    results = batch_tests_map[test_name]([row['values'] for row in rows], test_examples_map[data_type],
+                                         [row['num'] for row in rows], test_examples_map['is_numeric'])
+    return [((row['name'], test_name), round(result, 2)) for row, result in zip(rows, results)]
+
+
+def is_zero_result(row, test_examples_map):
+    if row['test_name'] in numeric_balanced_tests:
+        return row['num'] == 1 or test_examples_map['is_numeric'] == 1
+    if row['test_name'] in textual_balanced_tests:
+        return row['num'] == 0 or test_examples_map['is_numeric'] == 0
+    return False
+
+
+def get_prefilter_score(column_rows, test_examples_map, text_types):
+    """
+    Cheap similarity of a training column to the test column: closeness of their share of text,
+    similarity of their names, overlap of their numbers and whether the text search found the semantic type.
+    """
+    values = dict([(row['data_type'], row['values']) for row in column_rows])
+    score = 1 - abs(column_rows[0]['num'] - test_examples_map['is_numeric'])
+    if 'name_bigrams' in values:
+        score += label_bigram_test(values['name_bigrams'], test_examples_map['name_bigrams'], 0, 0)
+    if 'numeric_quartiles' in values:
+        score += quartile_coverage_test(values['numeric_quartiles'], test_examples_map['numeric_quartiles'], 0, 0)
+    if column_rows[0]['name'] in text_types:
+        score += 1
+    return score
+
+
+def prefilter_rows(column_rows_list, textual_train_map, test_examples_map):
+    """
+    Split the rows of the training columns into those whose tests run and those whose result is 0 without running:
+    tests zeroed by balance_result, and the expensive tests of the columns outside the prefilter_top_k best ranked.
+    :param column_rows_list: List of the rows of each training column, see zip_with_key.
+    :return: (rows to run, rows with result 0)
+    """
+    pruned = set()
+    if utils.prefilter_top_k is not None and len(column_rows_list) > utils.prefilter_top_k:
+        text_types = set([hit['_source']['semantic_type'] for hit in textual_train_map['hits']['hits']])
+        scores = [get_prefilter_score(column_rows, test_examples_map, text_types) if column_rows else 0
+                  for column_rows in column_rows_list]
+        ranking = sorted(range(len(column_rows_list)), key=lambda idx: -scores[idx])
+        pruned = set(ranking[utils.prefilter_top_k:])
+
+    rows, zero_rows = [], []
+    for idx, column_rows in enumerate(column_rows_list):
+        for row in column_rows:
+            if is_zero_result(row, test_examples_map):
+                prefilter_stats["short_circuited"] += 1
+                zero_rows.append(row)
+            elif idx in pruned and row['test_name'] in expensive_tests:
+                prefilter_stats["pruned"] += 1
+                zero_rows.append(row)
+            else:
+                prefilter_stats["run"] += 1
+                rows.append(row)
+    return rows, zero_rows
+
+
+def get_prefilter_report():
+    """
+    :return: Pair evaluations run, short circuited and pruned by get_test_results so far, with the share saved.
+    """
+    report = dict([(key, prefilter_stats[key]) for key in ["run", "short_circuited", "pruned"]])
+    total = sum(report.values())
+    report["saved"] = (report["short_circuited"] + report["pruned"]) * 1.0 / total if total else 0.0
+    return report
+
+
+def add_to_type_profile(profile, item_map):
+    """
+    Merge a training column into the profile of its semantic type, which has the fields of a column:
+    lists are concatenated, textual_set is the union and textual_minhash its sketch, sorted_numeric_list
+    stays sorted and numeric_quartiles are those of the merged numbers, is_numeric is the mean over the columns
+    and name_bigrams holds the bigrams of every column name. The fingerprints are those of the merged columns.
+    """
+    item_map = add_summaries(item_map)
+    count = profile["column_count"]
+    for field, value in item_map.items():
+        if field in ("semantic_type", "numeric_quartiles", "fingerprints"):
+            continue
+        elif field == "is_numeric":
+            profile[field] = (profile.get(field, 0) * count + value) * 1.0 / (count + 1)
+        elif field == "name_bigrams":
+            profile.setdefault(field, []).append(value)
+        elif field == "textual_set":
+            profile[field] = list(set(profile.get(field, [])).union(value))
+        elif field == "textual_minhash":
+            profile[field] = merge_minhash(profile.get(field, []), value)
+        elif field == "sorted_numeric_list":
+            profile[field] = list(heapq.merge(profile.get(field, []), value))
+        elif isinstance(value, list):
+            profile.setdefault(field, []).extend(value)
+        elif isinstance(value, str):
+            profile[field] = profile[field] + " " + value if field in profile else value
+    fingerprints = get_column_fingerprints(item_map)
+    if fingerprints:
+        # every field of a profile, e.g. its quartiles, may depend on every field of its columns: the fingerprint
+        # of a field is that of the whole merged columns, in the order in which their lists were concatenated
+        column_fingerprint = merge_fingerprints("", "".join([fingerprints[field] for field in sorted(fingerprints)]))
+        profile_fingerprints = dict(profile.get("fingerprints", {}))
+        for field in fingerprints:
+            profile_fingerprints[field] = merge_fingerprints(profile_fingerprints.get(field, ""), column_fingerprint)
+        profile["fingerprints"] = profile_fingerprints
+    if "sorted_numeric_list" in profile:
+        profile["numeric_quartiles"] = get_quartiles(profile["sorted_numeric_list"])
+    profile["column_count"] = count + 1
+    return profile
+
+
+def get_type_profiles(hits, type_profiles=None):
+    """
+    Profiles of the semantic types of the training columns, used instead of the columns
+    when utils.is_column_based is False.
+    :param hits: Training columns in the shape of search hits.
+    :param type_profiles: Profiles to merge the columns into, a new map if None. The profiles of the map are
+                          replaced by merged copies, the profiles themselves are not modified.
+    :return: Map from semantic type to profile.
+    """
+    type_profiles = OrderedDict() if type_profiles is None else type_profiles
+    # profiles created or copied by this call, which can be merged into in place
+    merged_types = set()
+    for hit in hits:
+        semantic_type = hit['_source']['semantic_type']
+        if semantic_type not in type_profiles:
+            type_profiles[semantic_type] = {"semantic_type": semantic_type, "column_count": 0}
+        elif semantic_type not in merged_types:
+            # profiles returned before are in use, e.g. by the bigram index of tests.label
+            type_profiles[semantic_type] = dict([(field, list(value) if isinstance(value, list) else value)
+                                                 for field, value in type_profiles[semantic_type].items()])
+        merged_types.add(semantic_type)
+        add_to_type_profile(type_profiles[semantic_type], hit['_source'])
+    return type_profiles
+
+
+def get_test_results(train_examples_map, textual_train_map, test_examples_map, is_labeled=False):
     feature_vectors = defaultdict(lambda: defaultdict(lambda: 0))
     logging.info("  => feature generation 1")
-    if is_column_based:
-        train_data_rdd = sc.parallelize(train_examples_map).map(lambda hit: hit['_source']).flatMap(
-            lambda hit: zip_with_key("%s" % (hit['semantic_type']), hit))
-
-        test_results = train_data_rdd.map(lambda row: ((row['name'], row['test_name']), row)).mapValues(
-            lambda row: round(
-                feature_tests_map[row['test_name']](row['values'], test_examples_map[row['data_type']], row['num'],
-                                                    test_examples_map['is_numeric']), 2)).reduceByKey(max).collect()
-    else:
-        train_data_rdd = sc.parallelize(train_examples_map).map(
-            lambda hit: (hit['_source']['semantic_type'], hit['_source'])).flatMap(
-            lambda row: [((row[0], x), row[1][x]) for x in
-                         ['char_length', 'histogram', "numeric"
-                             , 'values']]).reduceByKey(
-            lambda val1, val2: val1 + val2 if isinstance(val1, list) else val1 + " " + val2)
-
-        test_results = train_data_rdd.flatMap(
-            lambda row: [((row[0][0], x), round(feature_tests_map[x](row[1], test_examples_map[row[0][1]]), 2)) for
-                         x in data_tests_map[row[0][1]]]).collect()
+    # without is_column_based the searcher returns the profiles of the semantic types, which have the fields of columns
+    column_rows_list = [zip_with_key("%s" % (hit['_source']['semantic_type']), hit['_source'])
+                        for hit in train_examples_map]
+    rows, zero_rows = prefilter_rows(column_rows_list, textual_train_map, test_examples_map)
+    logging.info("  => {} pair evaluations, {} skipped".format(len(rows), len(zero_rows)))
+
+    test_result_map = {}
+    for row in zero_rows:
+        test_result_map[(row['name'], row['test_name'])] = 0
+    # results of the pairs computed before are read from the feature cache
+    feature_cache = get_feature_cache()
+    results = []
+    if feature_cache is not None:
+        test_fingerprints = get_column_fingerprints(test_examples_map)
+        cache_keys = dict([(id(row), get_cache_key(row, test_examples_map, test_fingerprints)) for row in rows])
+        missed_rows = []
+        for row in rows:
+            result = feature_cache.get(cache_keys[id(row)]) if cache_keys[id(row)] else None
+            if result is None:
+                missed_rows.append(row)
+            else:
+                results.append(((row['name'], row['test_name']), result))
+        logging.info("  => {} pair results cached".format(len(rows) - len(missed_rows)))
+        rows = missed_rows
+    batch_rows = defaultdict(list)
+    for row in rows:
+        if row['test_name'] in batch_tests_map:
+            batch_rows[row['test_name']].append(row)
+    rows = [row for row in rows if row['test_name'] not in batch_tests_map]
+    computed_results = map_values(partial(run_column_test, test_examples_map=test_examples_map), rows)
+    for test_name, test_rows in batch_rows.items():
+        rows.extend(test_rows)
+        computed_results.extend(run_batch_test(test_name, test_rows, test_examples_map))
+    if feature_cache is not None:
+        for row, (_, result) in zip(rows, computed_results):
+            if cache_keys[id(row)]:
+                feature_cache.put(cache_keys[id(row)], result)
+    results.extend(computed_results)
+    for key, result in results:
+        if key not in test_result_map or test_result_map[key] < result:
+            test_result_map[key] = result
+    test_results = list(test_result_map.items())
 
     logging.info("  => feature generation 2")
     for result in sorted(test_results):
@@ -1,5 +1,13 @@
+import threading
+
+import numpy as np
+
 __author__ = 'alse'
 
+# index of the bigrams of the last training columns, see get_bigram_index
+bigram_index = None
+bigram_index_lock = threading.Lock()
+
 
 def jaccard_similarity(x, y):
     if not x and not y:
@@ -10,8 +18,84 @@ def jaccard_similarity(x, y):
 
 
 def get_n_grams(sentence, n):
-    return [sentence[i:i + n] for i in range(len(sentence) - n)]
+    return [sentence[i:i + n] for i in range(len(sentence) - n + 1)]
 
 
 def label_text_test(train_label, test_label, num1, num2):
+    # the profile of a semantic type has the names of all its columns
+    if isinstance(train_label, list):
+        return max([label_text_test(label, test_label, num1, num2) for label in train_label] or [0])
     return jaccard_similarity(get_n_grams(train_label, 2), get_n_grams(test_label, 2))
+
+
+def get_name_bigrams(name):
+    return get_n_grams(name, 2)
+
+
+def label_bigram_test(train_bigrams, test_bigrams, num1, num2):
+    # the profile of a semantic type has the bigrams of all its column names
+    if train_bigrams and isinstance(train_bigrams[0], list):
+        return max([jaccard_similarity(bigrams, test_bigrams) for bigrams in train_bigrams])
+    return jaccard_similarity(train_bigrams, test_bigrams)
+
+
+class BigramIndex:
+    """
+    Sparse indicator matrix of the bigram sets of the training column names, so that the jaccard similarity
+    of a column name with all of them is one sparse matrix-vector product.
+    The profile of a semantic type has the bigrams of all its column names, one row each.
+    """
+    def __init__(self, train_bigrams_list):
+        from scipy.sparse import csr_matrix
+        # kept to recognize the training columns the index was built for, the lengths tell whether
+        # the bigrams of a column name were appended to a profile since
+        self.train_bigrams_list = list(train_bigrams_list)
+        self.lengths = [len(train_bigrams) for train_bigrams in self.train_bigrams_list]
+        self.vocabulary = {}
+        indices, indptr, group_starts = [], [0], []
+        for train_bigrams in self.train_bigrams_list:
+            group_starts.append(len(indptr) - 1)
+            rows = train_bigrams if train_bigrams and isinstance(train_bigrams[0], list) else [train_bigrams]
+            for bigrams in rows:
+                indices.extend(sorted(set([self.vocabulary.setdefault(bigram, len(self.vocabulary))
+                                           for bigram in bigrams])))
+                indptr.append(len(indices))
+        self.matrix = csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(indptr) - 1, len(self.vocabulary)))
+        self.sizes = np.diff(indptr)
+        self.group_starts = np.array(group_starts, dtype=np.int64)
+
+    def is_built_for(self, train_bigrams_list):
+        return len(train_bigrams_list) == len(self.train_bigrams_list) and all(
+            [bigrams is other and len(bigrams) == length
+             for bigrams, other, length in zip(train_bigrams_list, self.train_bigrams_list, self.lengths)])
+
+    def get_similarities(self, test_bigrams):
+        """
+        :return: Jaccard similarity of test_bigrams with every training column, the best one of a semantic type.
+        """
+        if not self.train_bigrams_list:
+            return np.zeros(0)
+        test_bigrams = set(test_bigrams)
+        vector = np.zeros(len(self.vocabulary))
+        vector[[self.vocabulary[bigram] for bigram in test_bigrams if bigram in self.vocabulary]] = 1
+        intersections = self.matrix.dot(vector)
+        unions = self.sizes + len(test_bigrams) - intersections
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities = np.where(unions > 0, intersections / unions, 0)
+        return np.maximum.reduceat(similarities, self.group_starts)
+
+
+def get_bigram_index(train_bigrams_list):
+    """
+    Index of the bigrams, rebuilt only when the training columns change:
+    the searchers return the same documents for every column predicted from a snapshot.
+    """
+    global bigram_index
+    with bigram_index_lock:
+        if bigram_index is None or not bigram_index.is_built_for(train_bigrams_list):
+            bigram_index = BigramIndex(train_bigrams_list)
+        return bigram_index
+
+
+def batch_label_bigram_test(train_bigrams_list, test_bigrams, num1_list, num2):
+    return list(get_bigram_index(train_bigrams_list).get_similarities(test_bigrams))
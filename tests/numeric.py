@@ -1,13 +1,18 @@
+import math
+
+import numpy as np
 from numpy import percentile
-from scipy.stats import mannwhitneyu, f_oneway, ks_2samp, ttest_ind
 
 from tests import balance_result
 
+# scipy.stats is imported in the tests on first use, importing it takes about a second
+
 __author__ = 'alse'
 
 
 def kolmogorov_smirnov_test(train_examples, test_examples, num1, num2):
     if len(train_examples) > 1 and len(test_examples) > 1:
+        from scipy.stats import ks_2samp
         result = ks_2samp(train_examples, test_examples)[1]
         return balance_result(num1, num2, True, result)
     return 0
@@ -15,7 +20,8 @@ def kolmogorov_smirnov_test(train_examples, test_examples, num1, num2):
 
 def welch_test(train_examples, test_examples, num1, num2):
     if len(train_examples) > 1 and len(test_examples) > 1:
-        result = ttest_ind(train_examples, test_examples, False)[1]
+        from scipy.stats import ttest_ind
+        result = ttest_ind(train_examples, test_examples, equal_var=False)[1]
         return balance_result(num1, num2, True, result)
     return 0
 
@@ -23,6 +29,7 @@ def welch_test(train_examples, test_examples, num1, num2):
 def mann_whitney_test(train_examples, test_examples, num1, num2):
     if len(train_examples) > 1 and len(test_examples) > 1:
         if test_examples[-1] != 0 and train_examples[-1] != 0:
+            from scipy.stats import mannwhitneyu
             result = mannwhitneyu(train_examples, test_examples)[1]
             return result
     return 0
@@ -30,6 +37,7 @@ def mann_whitney_test(train_examples, test_examples, num1, num2):
 
 def mann_whitney_u_test(train_examples, test_examples, num1, num2):
     if len(train_examples) > 1 and len(test_examples) > 1:
+        from scipy.stats import mannwhitneyu
         result = mannwhitneyu(train_examples, test_examples)[1]
         return balance_result(num1, num2, True, result)
     return 0
@@ -39,17 +47,30 @@ def anova_test(train_examples, test_examples):
     if test_examples[-1] > 50 or train_examples[-1] > 50:
         return 0
     if len(train_examples) > 1 and len(test_examples) > 1:
+        from scipy.stats import f_oneway
         result = f_oneway(train_examples, test_examples).pvalue
         return result
     return 0
 
 
+def get_quartiles(examples):
+    """
+    25th and 75th percentiles of a column, stored with the column so that coverage_test does not recompute them.
+    :return: [25th percentile, 75th percentile], empty for less than 2 examples.
+    """
+    if len(examples) > 1:
+        return [float(percentile(examples, 25)), float(percentile(examples, 75))]
+    return []
+
+
 def coverage_test(train_examples, test_examples, num1, num2):
-    if len(train_examples) > 1 and len(test_examples) > 1:
-        max1 = percentile(train_examples, 75)
-        min1 = percentile(train_examples, 25)
-        max2 = percentile(test_examples, 75)
-        min2 = percentile(test_examples, 25)
+    return quartile_coverage_test(get_quartiles(train_examples), get_quartiles(test_examples), num1, num2)
+
+
+def quartile_coverage_test(train_quartiles, test_quartiles, num1, num2):
+    if train_quartiles and test_quartiles:
+        min1, max1 = train_quartiles
+        min2, max2 = test_quartiles
         max3 = max(max1, max2)
         min3 = min(min1, min2)
         if min2 > max1 or min1 > max2:
@@ -62,3 +83,221 @@ def coverage_test(train_examples, test_examples, num1, num2):
             result = (min4 - max4) * 1.0 / (max3 - min3)
             return balance_result(num1, num2, True, result)
     return 0
+
+
+# largest sample for which scipy.stats.ks_2samp computes the exact p-value by default, its MAX_AUTO_N
+ks_exact_max_n = 10000
+
+# The batch tests compare one test column with many training columns in a few numpy passes:
+# the test sample is sorted once and the training samples are concatenated into segments.
+# They return the results of the per pair tests above, in the order of the training columns.
+
+def get_segments(samples):
+    """
+    Concatenate samples, each sorted, into one array.
+    :return: (values, start of each sample, length of each sample)
+    """
+    lengths = np.array([len(sample) for sample in samples], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    values = np.concatenate([np.sort(np.asarray(sample, dtype=float)) for sample in samples])
+    return values, starts, lengths
+
+
+def get_batch_pairs(train_examples_list, test_examples, min_size):
+    """
+    Indices of the training samples that the batch tests handle, the others are left to the per pair tests:
+    samples with less than min_size values have result 0 and samples with values that are not finite
+    go through scipy to keep its nan handling.
+    :return: (indices of the batched training samples, indices of the per pair ones, sorted test sample or None)
+    """
+    test = np.sort(np.asarray(test_examples, dtype=float))
+    if len(test) < min_size:
+        return [], [], None
+    if not np.all(np.isfinite(test)):
+        return [], [idx for idx, train in enumerate(train_examples_list) if len(train) >= min_size], None
+    batched, single = [], []
+    for idx, train in enumerate(train_examples_list):
+        if len(train) < min_size:
+            continue
+        if np.all(np.isfinite(train)):
+            batched.append(idx)
+        else:
+            single.append(idx)
+    return batched, single, test
+
+
+def get_right_counts(values, starts, lengths):
+    """
+    Number of values of its own segment which are at most each value, for segments which are sorted.
+    """
+    positions = np.arange(len(values))
+    ends = np.repeat(starts + lengths, lengths)
+    # last position of each run of equal values
+    is_last = np.ones(len(values), dtype=bool)
+    is_last[:-1] = values[:-1] != values[1:]
+    is_last[ends - 1] = True
+    last = np.minimum.accumulate(np.where(is_last, positions, len(values))[::-1])[::-1]
+    return last + 1 - np.repeat(starts, lengths)
+
+
+def get_ks_statistics(values, starts, lengths, test):
+    """
+    Two sided KS statistic of every segment against the test sample, computed as in scipy.stats.ks_2samp.
+    """
+    segment_ids = np.repeat(np.arange(len(lengths)), lengths)
+    # differences of the empirical distributions at the training values
+    differences = np.abs(get_right_counts(values, starts, lengths) / np.repeat(lengths, lengths) -
+                         np.searchsorted(test, values, side='right') / len(test))
+    statistics = np.maximum.reduceat(differences, starts)
+    # and at the test values, with segment keys on the ranks of the values in both samples
+    uniques = np.unique(np.concatenate([values, test]))
+    keys = segment_ids * len(uniques) + np.searchsorted(uniques, values)
+    test_ranks = np.searchsorted(uniques, test)
+    test_cdf = np.searchsorted(test, test, side='right') / len(test)
+    chunk = max(1, 2 ** 21 // len(test))
+    for first in range(0, len(lengths), chunk):
+        segments = np.arange(first, min(first + chunk, len(lengths)))
+        queries = segments[:, None] * len(uniques) + test_ranks[None, :]
+        counts = np.searchsorted(keys, queries, side='right') - starts[segments][:, None]
+        differences = np.abs(counts / lengths[segments][:, None] - test_cdf[None, :])
+        statistics[segments] = np.maximum(statistics[segments], differences.max(axis=1))
+    return statistics
+
+
+def get_ks_p_value(n1, n2, statistic):
+    """
+    Two sided p-value of a KS statistic of samples of sizes n1 and n2, as scipy.stats.ks_2samp computes it:
+    exact for samples of at most ks_exact_max_n values, asymptotic for larger ones.
+    :return: p-value, None if this scipy does not expose its exact computation as expected.
+    """
+    from scipy.stats import kstwo
+    if max(n1, n2) <= ks_exact_max_n:
+        # a private function of scipy, which may be moved or changed by any release
+        try:
+            from scipy.stats._stats_py import _attempt_exact_2kssamp
+            success, _, result = _attempt_exact_2kssamp(int(n1), int(n2), math.gcd(int(n1), int(n2)), statistic,
+                                                        'two-sided')
+        except (ImportError, AttributeError, TypeError, ValueError):
+            return None
+        if success:
+            return float(np.clip(result, 0, 1))
+    m, n = max(n1, n2) * 1.0, min(n1, n2) * 1.0
+    return float(np.clip(kstwo.sf(statistic, np.round(m * n / (m + n))), 0, 1))
+
+
+def batch_kolmogorov_smirnov_test(train_examples_list, test_examples, num1_list, num2):
+    results = [0] * len(train_examples_list)
+    batched, single, test = get_batch_pairs(train_examples_list, test_examples, 2)
+    if batched:
+        values, starts, lengths = get_segments([train_examples_list[idx] for idx in batched])
+        statistics = get_ks_statistics(values, starts, lengths, test)
+        # the p-value only depends on the sample sizes and the statistic, columns of a type share them often
+        p_values = {}
+        for idx, n1, statistic in zip(batched, lengths, statistics):
+            key = (int(n1), float(statistic))
+            if key not in p_values:
+                p_values[key] = get_ks_p_value(key[0], len(test), key[1])
+            if p_values[key] is None:
+                single.append(idx)
+            else:
+                results[idx] = balance_result(num1_list[idx], num2, True, p_values[key])
+    for idx in single:
+        results[idx] = kolmogorov_smirnov_test(train_examples_list[idx], test_examples, num1_list[idx], num2)
+    return results
+
+
+def batch_welch_test(train_examples_list, test_examples, num1_list, num2):
+    from scipy.stats import t as t_distribution
+    results = [0] * len(train_examples_list)
+    batched, single, test = get_batch_pairs(train_examples_list, test_examples, 2)
+    if batched:
+        values, starts, lengths = get_segments([train_examples_list[idx] for idx in batched])
+        means = np.add.reduceat(values, starts) / lengths
+        variances = np.add.reduceat((values - np.repeat(means, lengths)) ** 2, starts) / (lengths - 1)
+        n2 = len(test)
+        test_variance = np.var(test, ddof=1) / n2
+        # as in scipy.stats.ttest_ind with equal_var=False
+        with np.errstate(divide='ignore', invalid='ignore'):
+            train_variances = variances / lengths
+            dfs = (train_variances + test_variance) ** 2 / (
+                train_variances ** 2 / (lengths - 1) + test_variance ** 2 / (n2 - 1))
+            dfs = np.where(np.isnan(dfs), 1, dfs)
+            statistics = (means - np.mean(test)) / np.sqrt(train_variances + test_variance)
+            p_values = 2 * t_distribution.sf(np.abs(statistics), dfs)
+        for idx, result in zip(batched, p_values):
+            results[idx] = balance_result(num1_list[idx], num2, True, result)
+    for idx in single:
+        results[idx] = welch_test(train_examples_list[idx], test_examples, num1_list[idx], num2)
+    return results
+
+
+def get_mann_whitney_p_values(values, starts, lengths, test):
+    """
+    Two sided p-values of the Mann-Whitney U test of every segment against the test sample,
+    with the normal approximation, tie and continuity corrections of scipy.stats.mannwhitneyu.
+    """
+    from scipy.special import ndtr
+    n2 = len(test)
+    lefts = np.searchsorted(test, values, side='left')
+    rights = np.searchsorted(test, values, side='right')
+    # U of the training sample: test values below each training value, ties count half
+    u1 = np.add.reduceat(lefts + 0.5 * (rights - lefts), starts)
+    u = np.maximum(u1, lengths * n2 - u1)
+
+    # sum of t^3 - t over the groups of ties t in both samples, from the runs of equal values of each sample
+    is_first = np.ones(len(values), dtype=bool)
+    is_first[1:] = values[1:] != values[:-1]
+    is_first[starts] = True
+    run_starts = np.flatnonzero(is_first)
+    run_counts = np.diff(np.append(run_starts, len(values))).astype(float)
+    run_test_counts = (rights - lefts)[run_starts].astype(float)
+    run_segments = np.searchsorted(starts, run_starts, side='right') - 1
+    _, test_counts = np.unique(test, return_counts=True)
+    test_term = np.sum(test_counts.astype(float) ** 3 - test_counts)
+    # (c1 + c2)^3 - (c1 + c2) for the values in both samples, c2^3 - c2 of the test sample is added once
+    run_terms = (run_counts + run_test_counts) ** 3 - run_counts - run_test_counts ** 3
+    tie_terms = np.bincount(run_segments, weights=run_terms, minlength=len(lengths)) + test_term
+
+    n = lengths + n2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = np.sqrt(lengths * n2 / 12.0 * ((n + 1) - tie_terms / (n * (n - 1))))
+        z = (u - lengths * n2 / 2.0 - 0.5) / s
+    return np.clip(2 * ndtr(-z), 0, 1)
+
+
+def split_mann_whitney_pairs(train_examples_list, test_examples):
+    """
+    :return: (indices of the batched training samples, indices of the per pair ones, sorted test sample or None)
+    """
+    batched, single, test = get_batch_pairs(train_examples_list, test_examples, 2)
+    # scipy may use the exact distribution when a sample has at most 8 values
+    if test is not None and len(test) <= 8:
+        return [], single + batched, test
+    single += [idx for idx in batched if len(train_examples_list[idx]) <= 8]
+    batched = [idx for idx in batched if len(train_examples_list[idx]) > 8]
+    return batched, single, test
+
+
+def batch_mann_whitney_test(train_examples_list, test_examples, num1_list, num2):
+    results = [0] * len(train_examples_list)
+    batched, single, test = split_mann_whitney_pairs(train_examples_list, test_examples)
+    batched = [idx for idx in batched if test_examples[-1] != 0 and train_examples_list[idx][-1] != 0]
+    if batched:
+        values, starts, lengths = get_segments([train_examples_list[idx] for idx in batched])
+        for idx, result in zip(batched, get_mann_whitney_p_values(values, starts, lengths, test)):
+            results[idx] = result
+    for idx in single:
+        results[idx] = mann_whitney_test(train_examples_list[idx], test_examples, num1_list[idx], num2)
+    return results
+
+
+def batch_mann_whitney_u_test(train_examples_list, test_examples, num1_list, num2):
+    results = [0] * len(train_examples_list)
+    batched, single, test = split_mann_whitney_pairs(train_examples_list, test_examples)
+    if batched:
+        values, starts, lengths = get_segments([train_examples_list[idx] for idx in batched])
+        for idx, result in zip(batched, get_mann_whitney_p_values(values, starts, lengths, test)):
+            results[idx] = balance_result(num1_list[idx], num2, True, result)
+    for idx in single:
+        results[idx] = mann_whitney_u_test(train_examples_list[idx], test_examples, num1_list[idx], num2)
+    return results
@@ -0,0 +1,125 @@
+import os
+import threading
+
+from search.embedded import EmbeddedIndex
+
+__author__ = 'minh'
+
+
+def get_state(index):
+    return index.indices, index.docs, index.postings, index.doc_lengths, index.next_id, index.generation
+
+
+def fill(index, count, start=0):
+    index.create("index1")
+    for idx in range(start, start + count):
+        index.add("index{}".format(idx % 2 + 1), "source{}".format(idx % 3), {"textual": "city name {}".format(idx)})
+
+
+def test_changes_are_replayed_without_save(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    index = EmbeddedIndex(path)
+    fill(index, 20)
+    index.delete("index2")
+    assert not os.path.exists(path)
+    assert get_state(EmbeddedIndex(path)) == get_state(index)
+
+
+def test_changes_after_save_are_replayed(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    index = EmbeddedIndex(path)
+    fill(index, 10)
+    index.save()
+    assert not os.path.exists(index.get_log_path())
+    fill(index, 10, 10)
+    index.delete("index1")
+    assert get_state(EmbeddedIndex(path)) == get_state(index)
+    index.clear()
+    assert get_state(EmbeddedIndex(path)) == get_state(index)
+
+
+def test_stale_log_is_ignored(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    index = EmbeddedIndex(path)
+    fill(index, 10)
+    index.log_file.close()
+    with open(index.get_log_path(), "rb") as f:
+        log = f.read()
+    index.save()
+    # crash between saving the index and removing its log
+    with open(index.get_log_path(), "wb") as f:
+        f.write(log)
+    assert get_state(EmbeddedIndex(path)) == get_state(index)
+
+
+def test_truncated_change_is_dropped(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    index = EmbeddedIndex(path)
+    fill(index, 10)
+    index.log_file.close()
+    with open(index.get_log_path(), "r+b") as f:
+        f.truncate(os.path.getsize(index.get_log_path()) - 5)
+    loaded = EmbeddedIndex(path)
+    assert len(loaded.docs) == 9
+    fill(loaded, 5, 10)
+    assert get_state(EmbeddedIndex(path)) == get_state(loaded)
+
+
+def test_log_is_compacted_once_it_outgrows_the_index(tmp_path):
+    path = str(tmp_path / "index.pickle")
+    index = EmbeddedIndex(path)
+    index.create("index1")
+    for idx in range(300):
+        index.add("index1", "source", {"textual": "value {} ".format(idx) * 1000})
+        assert not os.path.exists(index.get_log_path()) or \
+            os.path.getsize(index.get_log_path()) <= max(index.snapshot_size, 2 ** 20)
+    assert os.path.exists(path)
+    assert get_state(EmbeddedIndex(path)) == get_state(index)
+
+
+def test_scan_returns_copies():
+    index = EmbeddedIndex()
+    fill(index, 4)
+    for hit in index.scan("index*", []):
+        hit["_source"]["textual"] = None
+    assert all([hit["_source"]["textual"] for hit in index.scan("index*", [])])
+    hits = index.match("index*", [], "city", 10)["hits"]["hits"]
+    assert len(hits) == 4
+    hits[0]["_source"]["textual"] = None
+    assert all([hit["_source"]["textual"] for hit in index.scan("index*", [])])
+
+
+def test_concurrent_changes_and_searches(tmp_path):
+    # the requests of a threaded server index and search the same index
+    index = EmbeddedIndex(str(tmp_path / "index.pickle"))
+    index.snapshot_size = 0
+    errors = []
+    done = threading.Event()
+
+    def change():
+        try:
+            for idx in range(30):
+                fill(index, 20, idx * 20)
+                index.delete("index2")
+                if idx % 10 == 0:
+                    index.save()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def search():
+        try:
+            while not done.is_set():
+                index.scan("index*", [])
+                index.match("index*", [], "city name 7", 10)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=change)] + [threading.Thread(target=search) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert get_state(EmbeddedIndex(index.path)) == get_state(index)
@@ -0,0 +1,115 @@
+import random
+
+import pytest
+
+from lib import feature_cache as feature_cache_module
+from lib import utils
+from lib.column import Column
+from lib.feature_cache import FeatureCache, get_feature_cache
+from tests.integrated import get_test_results, get_type_profiles
+
+__author__ = 'minh'
+
+
+@pytest.fixture
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(utils, "feature_cache_size", 100000)
+    monkeypatch.setattr(utils, "feature_cache_path", None)
+    monkeypatch.setattr(feature_cache_module, "feature_cache", None)
+
+
+def get_column(rng, name, semantic_type):
+    column = Column(name, "source")
+    column.semantic_type = semantic_type
+    if rng.random() < 0.5:
+        column.add_values([str(rng.randint(0, 1000) * rng.random()) for _ in range(rng.randint(5, 60))])
+    else:
+        column.add_values(["{} {}".format(rng.choice(["north", "south", "east"]), rng.randint(0, 30))
+                           for _ in range(rng.randint(5, 60))])
+    return column
+
+
+def get_hits(rng):
+    return [{"_source": get_column(rng, "column{}".format(idx), "type{}".format(idx % 4)).to_json()}
+            for idx in range(12)]
+
+
+def get_results(hits, test_column):
+    return get_test_results(hits, {"hits": {"hits": []}}, test_column.to_json())
+
+
+def check_cached_results(hits, test_columns):
+    expected = [get_results(hits, column) for column in test_columns]
+    for _ in range(2):
+        assert [get_results(hits, column) for column in test_columns] == expected
+
+
+def test_cached_results_match_computed_results(cache_enabled):
+    rng = random.Random(0)
+    hits = get_hits(rng)
+    test_columns = [get_column(rng, "test{}".format(idx), None) for idx in range(4)]
+    utils.feature_cache_size = None
+    expected = [get_results(hits, column) for column in test_columns]
+    utils.feature_cache_size = 100000
+    # as documents indexed without the cache, fingerprinted when read
+    hits = [{"_source": dict(hit["_source"], fingerprints=None)} for hit in hits]
+    for _ in range(2):
+        assert [get_results(hits, column) for column in test_columns] == expected
+    assert get_feature_cache().get_stats()["hits"] > 0
+
+
+def test_cached_results_match_computed_results_of_type_profiles(cache_enabled, monkeypatch):
+    monkeypatch.setattr(utils, "is_column_based", False)
+    rng = random.Random(1)
+    hits = get_hits(rng)
+    test_columns = [get_column(rng, "test{}".format(idx), None) for idx in range(4)]
+    check_cached_results([{"_source": profile} for profile in get_type_profiles(hits).values()], test_columns)
+    # a profile which gains a column has other results
+    check_cached_results([{"_source": profile} for profile in get_type_profiles(hits + get_hits(rng)).values()],
+                         test_columns)
+    assert get_feature_cache().get_stats()["hits"] > 0
+
+
+def test_changed_columns_are_not_read_from_cache(cache_enabled):
+    rng = random.Random(2)
+    hits = get_hits(rng)
+    test_column = get_column(rng, "test", None)
+    get_results(hits, test_column)
+    test_column.add_values(["north 7", "12.5"])
+    results = get_results(hits, test_column)
+    feature_cache_module.feature_cache = None
+    utils.feature_cache_size = None
+    assert get_results(hits, test_column) == results
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = FeatureCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.get_stats()["evicted"] == 1
+
+
+def test_results_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(feature_cache_module.time, "time", lambda: now[0])
+    cache = FeatureCache(10, ttl=60)
+    cache.put("a", 1)
+    now[0] += 30
+    assert cache.get("a") == 1
+    now[0] += 31
+    assert cache.get("a") is None
+    assert cache.get_stats()["expired"] == 1
+
+
+def test_results_of_other_feature_tests_are_not_loaded(tmp_path, monkeypatch):
+    path = str(tmp_path / "feature_cache.pickle")
+    cache = FeatureCache(10, path=path)
+    cache.put("a", 1)
+    cache.save()
+    assert FeatureCache(10, path=path).get("a") == 1
+    monkeypatch.setattr(feature_cache_module, "code_version", "other")
+    assert FeatureCache(10, path=path).get("a") is None
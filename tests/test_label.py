@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from tests.integrated import get_type_profiles
+from tests.label import get_name_bigrams, label_bigram_test, batch_label_bigram_test
+
+__author__ = 'minh'
+
+
+def get_name(rng):
+    return "".join([rng.choice("abcde_") for _ in range(rng.randint(0, 8))])
+
+
+def check_batch(train_bigrams_list, test_bigrams):
+    expected = [label_bigram_test(train_bigrams, test_bigrams, 0, 0) for train_bigrams in train_bigrams_list]
+    results = batch_label_bigram_test(train_bigrams_list, test_bigrams, [0] * len(train_bigrams_list), 0)
+    assert results == pytest.approx(expected)
+
+
+def test_batch_label_test_matches_single_columns():
+    rng = random.Random(0)
+    for _ in range(20):
+        train_bigrams_list = [get_name_bigrams(get_name(rng)) for _ in range(rng.randint(0, 30))]
+        for _ in range(5):
+            check_batch(train_bigrams_list, get_name_bigrams(get_name(rng)))
+
+
+def test_batch_label_test_matches_type_profiles():
+    rng = random.Random(1)
+    for _ in range(20):
+        train_bigrams_list = [[get_name_bigrams(get_name(rng)) for _ in range(rng.randint(1, 5))]
+                              for _ in range(rng.randint(0, 10))]
+        for _ in range(5):
+            check_batch(train_bigrams_list, get_name_bigrams(get_name(rng)))
+
+
+def test_batch_label_test_follows_profiles_merged_in_place():
+    train_bigrams_list = [[get_name_bigrams("abc")], [get_name_bigrams("xyz")]]
+    check_batch(train_bigrams_list, get_name_bigrams("city"))
+    train_bigrams_list[0].append(get_name_bigrams("city"))
+    check_batch(train_bigrams_list, get_name_bigrams("city"))
+
+
+def test_merged_type_profiles_are_copies():
+    hits = [{"_source": {"semantic_type": "city", "name_bigrams": get_name_bigrams(name), "textual_list": [name]}}
+            for name in ["town", "city"]]
+    type_profiles = get_type_profiles(hits[:1])
+    profile = type_profiles["city"]
+    get_type_profiles(hits[1:], type_profiles)
+    assert profile["name_bigrams"] == [get_name_bigrams("town")]
+    assert profile["textual_list"] == ["town"]
+    assert type_profiles["city"]["name_bigrams"] == [get_name_bigrams("town"), get_name_bigrams("city")]
+    assert type_profiles["city"]["column_count"] == 2
@@ -0,0 +1,110 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from tests.numeric import kolmogorov_smirnov_test, welch_test, mann_whitney_test, mann_whitney_u_test, \
+    batch_kolmogorov_smirnov_test, batch_welch_test, batch_mann_whitney_test, batch_mann_whitney_u_test, \
+    get_ks_p_value, ks_exact_max_n
+
+__author__ = 'minh'
+
+test_pairs = [(kolmogorov_smirnov_test, batch_kolmogorov_smirnov_test), (welch_test, batch_welch_test),
+              (mann_whitney_test, batch_mann_whitney_test), (mann_whitney_u_test, batch_mann_whitney_u_test)]
+
+
+def get_sample(rng, size):
+    kind = rng.randint(4)
+    if kind == 0:
+        values = rng.normal(rng.uniform(-2, 2), rng.uniform(0.5, 3), size)
+    elif kind == 1:
+        # many ties
+        values = rng.randint(0, 6, size).astype(float)
+    elif kind == 2:
+        values = rng.exponential(rng.uniform(1, 100), size)
+    else:
+        values = np.full(size, 3.0)
+    return sorted(values.tolist())
+
+
+def get_train_samples(rng, test_size):
+    sizes = [0, 1, 2, 3, 8, 9, 25, 100, 1000, test_size] + rng.randint(2, 400, 20).tolist()
+    return [get_sample(rng, size) for size in sizes]
+
+
+def check_batch(test, batch_test, train_examples_list, test_examples):
+    num1_list = [len(train) for train in train_examples_list]
+    num2 = len(test_examples)
+    expected = [test(train, test_examples, num1, num2) for train, num1 in zip(train_examples_list, num1_list)]
+    results = batch_test(train_examples_list, test_examples, num1_list, num2)
+    assert len(results) == len(expected)
+    for result, value in zip(results, expected):
+        if np.isnan(value):
+            assert np.isnan(result)
+        else:
+            assert result == pytest.approx(value, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("test,batch_test", test_pairs)
+def test_batch_tests_match_per_pair_tests(test, batch_test):
+    rng = np.random.RandomState(0)
+    for test_size in [0, 1, 2, 5, 9, 40, 300]:
+        for _ in range(5):
+            check_batch(test, batch_test, get_train_samples(rng, test_size), get_sample(rng, test_size))
+
+
+@pytest.mark.parametrize("test,batch_test", test_pairs)
+def test_batch_tests_match_per_pair_tests_on_values_not_finite(test, batch_test):
+    rng = np.random.RandomState(1)
+    train_examples_list = get_train_samples(rng, 50)
+    train_examples_list[3] = sorted(train_examples_list[3] + [float("inf")])
+    train_examples_list[12] = train_examples_list[12] + [float("nan")]
+    check_batch(test, batch_test, train_examples_list, get_sample(rng, 50))
+    check_batch(test, batch_test, get_train_samples(rng, 50), get_sample(rng, 50) + [float("nan")])
+
+
+def test_batch_ks_test_matches_scipy_around_exact_limit():
+    rng = np.random.RandomState(2)
+    test_examples = get_sample(rng, 200)
+    # scipy is exact up to 10000 values per sample, whatever the product of the sizes, asymptotic beyond
+    train_examples_list = [sorted(rng.normal(0.05, 1, size).tolist()) for size in [5000, 10000, 10001, 20000]]
+    check_batch(kolmogorov_smirnov_test, batch_kolmogorov_smirnov_test, train_examples_list, test_examples)
+    check_batch(kolmogorov_smirnov_test, batch_kolmogorov_smirnov_test, train_examples_list[:2],
+                sorted(rng.normal(0, 1, 9000).tolist()))
+
+
+def test_ks_p_value_matches_scipy_exact_p_value():
+    rng = np.random.RandomState(3)
+    for n1, n2 in [(1, 1), (2, 7), (30, 30), (45, 120), (500, 800), (ks_exact_max_n, 300)]:
+        first, second = rng.normal(0, 1, n1), rng.normal(0.1, 1.2, n2)
+        expected = stats.ks_2samp(first, second, method="exact")
+        assert get_ks_p_value(n1, n2, expected.statistic) == pytest.approx(expected.pvalue, rel=1e-9, abs=1e-12)
+
+
+def get_scipy_stats_py(*attempt_exact):
+    # scipy.stats._stats_py as the batch test imports it, scipy itself keeps its own functions
+    module = types.ModuleType("scipy.stats._stats_py")
+    if attempt_exact:
+        module._attempt_exact_2kssamp = attempt_exact[0]
+    return module
+
+
+@pytest.mark.parametrize("error", [AttributeError, TypeError, ValueError])
+def test_batch_ks_test_falls_back_when_scipy_changes(monkeypatch, error):
+    def attempt_exact(*args):
+        raise error()
+    monkeypatch.setitem(sys.modules, "scipy.stats._stats_py", get_scipy_stats_py(attempt_exact))
+    assert get_ks_p_value(10, 20, 0.5) is None
+    rng = np.random.RandomState(4)
+    check_batch(kolmogorov_smirnov_test, batch_kolmogorov_smirnov_test, get_train_samples(rng, 40),
+                get_sample(rng, 40))
+
+
+def test_batch_ks_test_falls_back_without_scipy_exact_computation(monkeypatch):
+    monkeypatch.setitem(sys.modules, "scipy.stats._stats_py", get_scipy_stats_py())
+    assert get_ks_p_value(10, 20, 0.5) is None
+    rng = np.random.RandomState(5)
+    check_batch(kolmogorov_smirnov_test, batch_kolmogorov_smirnov_test, get_train_samples(rng, 40),
+                get_sample(rng, 40))
@@ -0,0 +1,57 @@
+import os
+
+from lib.profile_cache import ProfileCache, eviction_ratio
+from lib.source import Source
+
+__author__ = 'minh'
+
+
+def get_source(name, size):
+    source = Source(name)
+    # random bytes do not compress, so every entry has about size bytes
+    source.payload = os.urandom(size)
+    return source
+
+
+def test_load_returns_saved_source(tmp_path):
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("a,b\n1,2\n")
+    cache = ProfileCache(str(tmp_path / "cache"), 2 ** 20)
+    key = cache.get_key(str(data_path), [])
+    assert cache.load(key) is None
+    cache.save(key, get_source("data", 100))
+    assert cache.load(key).payload == cache.load(key).payload
+    assert cache.load(key).name == "data"
+
+
+def test_key_changes_with_the_file(tmp_path):
+    data_path = tmp_path / "data.csv"
+    data_path.write_text("a,b\n1,2\n")
+    key = ProfileCache.get_key(str(data_path), [])
+    data_path.write_text("a,b\n1,2\n3,4\n")
+    assert ProfileCache.get_key(str(data_path), []) != key
+
+
+def test_eviction_keeps_the_cache_under_max_bytes(tmp_path):
+    cache = ProfileCache(str(tmp_path / "cache"), 10000)
+    for idx in range(30):
+        cache.save("key{}".format(idx), get_source(str(idx), 1000))
+        total = sum([size for _, size, _ in cache.get_entries()])
+        assert total <= 10000
+        assert cache.size == total
+    # the entries saved last are kept
+    assert cache.load("key29") is not None
+    assert cache.load("key0") is None
+
+
+def test_directory_is_listed_only_to_evict(tmp_path, monkeypatch):
+    cache = ProfileCache(str(tmp_path / "cache"), 10000)
+    evictions = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: evictions.append(1) or evict())
+    for idx in range(300):
+        cache.save("key{}".format(idx), get_source(str(idx), 100))
+    entry_size = max([size for _, size, _ in cache.get_entries()])
+    # every eviction frees (1 - eviction_ratio) of max_bytes, room for several more entries
+    assert 0 < len(evictions) <= 300 * entry_size / (10000 * (1 - eviction_ratio)) + 1
+    assert len(evictions) < 300 / 4
@@ -0,0 +1,48 @@
+from lib.sampling import StratifiedSampler, HeadSampler, ReservoirSampler
+
+__author__ = 'minh'
+
+
+def get_values(count):
+    values = []
+    for idx in range(count):
+        if idx % 3 == 0:
+            values.append(str(idx))
+        elif idx % 3 == 1:
+            values.append("value {}".format(idx))
+        else:
+            values.append("text")
+    return values
+
+
+def test_stratified_sample_is_stable():
+    sampler = StratifiedSampler(50, 0)
+    sampler.extend(get_values(1000))
+    assert list(sampler) == list(sampler)
+    assert len(list(sampler)) == 50
+
+
+def test_stratified_sample_is_redrawn_after_append():
+    sampler = StratifiedSampler(50, 0)
+    sampler.extend(get_values(1000))
+    first = list(sampler)
+    sampler.extend(get_values(1000))
+    assert sampler.count == 2000
+    assert len(list(sampler)) == 50
+    assert list(sampler) == list(sampler)
+    assert first is not sampler.selection
+
+
+def test_stratified_sample_keeps_proportions():
+    sampler = StratifiedSampler(90, 0)
+    sampler.extend(get_values(900))
+    strata = [StratifiedSampler.get_stratum(value) for value in sampler]
+    assert strata.count("numeric") == strata.count("mixed") == strata.count("textual") == 30
+
+
+def test_small_columns_are_kept_whole():
+    values = get_values(20)
+    for sampler_class in [HeadSampler, ReservoirSampler, StratifiedSampler]:
+        sampler = sampler_class(50, 0)
+        sampler.extend(values)
+        assert list(sampler) == values
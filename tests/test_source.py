@@ -0,0 +1,104 @@
+import io
+import json
+import os
+
+from lib import utils
+from lib.source import Source
+
+__author__ = 'minh'
+
+data_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "datasets")
+
+
+def detect_encoding_by_lines(f, limit=100):
+    # the detection on decoded lines which Source.detect_encoding replaces
+    for enc in Source.encodings:
+        f.seek(0)
+        reader = io.TextIOWrapper(f, encoding=enc)
+        try:
+            [reader.readline() for _ in range(limit)]
+            return enc
+        except UnicodeError:
+            continue
+        finally:
+            reader.detach()
+            f.seek(0)
+
+
+class CountingReader(io.RawIOBase):
+    """
+    Raw stream over bytes which counts the bytes read from it.
+    """
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.stream.readinto(buffer)
+        self.bytes_read += count
+        return count
+
+
+def get_samples():
+    text = "name,city\nJosé,Zürich\nLi,北京\n" * 50
+    return [text.encode("utf-8"), text.encode("utf-16"), "Café,Müller\n".encode("latin-1") * 200,
+            b"abc\n" * 1000, b"", "é".encode("utf-8")[:1], ("x" * 100 + "é").encode("utf-8") * 30000]
+
+
+def test_detect_encoding_matches_line_detection():
+    for data in get_samples():
+        assert Source.detect_encoding(io.BufferedReader(io.BytesIO(data), Source.buffer_size)) == \
+            detect_encoding_by_lines(io.BufferedReader(io.BytesIO(data), Source.buffer_size))
+
+
+def test_detect_encoding_matches_line_detection_on_datasets():
+    for root, _, filenames in os.walk(data_folder):
+        for filename in filenames:
+            with open(os.path.join(root, filename), "rb", buffering=Source.buffer_size) as f:
+                enc = Source.detect_encoding(f)
+                assert f.tell() == 0
+                assert enc == detect_encoding_by_lines(f), filename
+
+
+def test_single_line_file_is_read_once():
+    data = ("[" + ",".join(['{"name": "value %d"}' % idx for idx in range(200000)]) + "]").encode("utf-8")
+    raw = CountingReader(data)
+    f = io.BufferedReader(raw, Source.buffer_size)
+    assert Source.detect_encoding(f) == "utf-8"
+    assert raw.bytes_read <= Source.buffer_size
+    assert f.read() == data
+    assert raw.bytes_read == len(data)
+
+
+def test_json_array_is_decoded_across_chunk_boundaries():
+    text = '[1.5, -2e10, 3, 1.25E-3, 10, true, null, "x, y", {"a": 1.5, "b": [2, "]"]}, [], 7.0e+2 , 42]'
+    for chunk_size in range(1, len(text) + 2):
+        assert list(Source.iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text), chunk_size
+
+
+def get_column_values(source):
+    return dict([(name, (column.value_list, column.textual_list, list(column.numeric_list), column.word_set))
+                 for name, column in source.column_map.items()])
+
+
+def test_unsampled_values_are_added_in_chunks(monkeypatch):
+    paths = [os.path.join(data_folder, "museum", "data", filename)
+             for filename in ["s21-s-met.json", "s22-s-moca.xml"]]
+    for path, read in zip(paths, [Source.read_data_from_json, Source.read_data_from_xml]):
+        monkeypatch.setattr(utils, "bulk_chunk_size", 10 ** 9)
+        expected = Source("source")
+        read(expected, path)
+        monkeypatch.setattr(utils, "bulk_chunk_size", 7)
+        source = Source("source")
+        chunk_sizes = []
+        add_column_values = source.add_column_values
+        monkeypatch.setattr(source, "add_column_values", lambda value_map: chunk_sizes.append(
+            max([len(values) for values in value_map.values()] or [0])) or add_column_values(value_map))
+        read(source, path)
+        assert get_column_values(source) == get_column_values(expected)
+        assert len(chunk_sizes) > 1
+        # a record holds at most a few values of a column, lists of a json node are flattened
+        assert max(chunk_sizes) <= 7 * 20
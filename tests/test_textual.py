@@ -0,0 +1,88 @@
+import random
+import re
+import sys
+import unicodedata
+
+from lib import utils
+from lib.column import Column
+from tests import balance_result
+from tests.textual import get_minhash, merge_minhash, get_minhash_size, minhash_jaccard_test, jaccard_test, \
+    get_abbr_patterns, join_abbr_values, match_abbr, separator_class, get_abbr_cache, compile_abbr_patterns
+
+__author__ = 'minh'
+
+
+def get_sets(rng, count):
+    # new values for every pair, so that the estimates of the pairs are independent
+    values = ["value {}".format(rng.getrandbits(40)) for _ in range(3 * count)]
+    shared = values[:rng.randint(0, count)]
+    first = set(shared + values[count:count + rng.randint(1, count)])
+    second = set(shared + values[2 * count:2 * count + rng.randint(1, count)])
+    return first, second
+
+
+def test_minhash_estimate_is_within_error(monkeypatch):
+    monkeypatch.setattr(utils, "jaccard_error", 0.1)
+    rng = random.Random(0)
+    # both tests scale their result by balance_result
+    error = utils.jaccard_error * balance_result(1, 1, False, 1.0)
+    within = 0
+    for _ in range(200):
+        first, second = get_sets(rng, 500)
+        estimate = minhash_jaccard_test(get_minhash(first), get_minhash(second), 1, 1)
+        within += abs(estimate - jaccard_test(first, second, 1, 1)) <= error
+    # the error bound holds with 95% probability
+    assert within >= 180
+
+
+def test_minhash_of_union_is_merge_of_minhashes():
+    rng = random.Random(1)
+    for _ in range(10):
+        first, second = get_sets(rng, 200)
+        assert merge_minhash(get_minhash(first), get_minhash(second)) == get_minhash(first | second)
+        assert merge_minhash([], get_minhash(second)) == get_minhash(second)
+
+
+def test_smaller_minhash_is_prefix():
+    values = ["value {}".format(idx) for idx in range(300)]
+    assert get_minhash(values, get_minhash_size(0.1)) == get_minhash(values, 400)[:get_minhash_size(0.1)]
+
+
+def test_minhash_is_stored_in_approximate_mode_only(monkeypatch):
+    column = Column("city", "source")
+    column.add_values(["Sydney", "Perth", "Darwin"])
+    assert "textual_minhash" not in column.to_json()
+    monkeypatch.setattr(utils, "jaccard_error", 0.1)
+    assert column.to_json()["textual_minhash"] == get_minhash(column.textual_set)
+
+
+def test_separator_class_matches_unicode_separators():
+    pattern = re.compile(separator_class)
+    for code in range(sys.maxunicode + 1):
+        char = chr(code)
+        assert bool(pattern.match(char)) == unicodedata.category(char).startswith("Z"), hex(code)
+
+
+def test_joined_abbreviation_match_matches_single_patterns():
+    rng = random.Random(3)
+    words = ["New", "south", "Wales", "north", "Sydney", "NSW", "N.S.W", "ns", "w", "x"]
+    separators = [" ", "\u00a0", "\u3000", "-", "\n", ""]
+    for _ in range(300):
+        values = ["".join([rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(1, 4))])
+                  for _ in range(rng.randint(0, 6))]
+        joined_values, other_values = join_abbr_values(values)
+        for abbr in ["NSW", "N.S.W", "NS", "SW", "W", "NSWALES", "", "?"]:
+            expected = any([pattern.match(value) for value in values for pattern in get_abbr_patterns(abbr)])
+            assert match_abbr(abbr, joined_values, other_values) == expected, (abbr, values)
+
+
+def test_abbreviation_cache_follows_its_setting(monkeypatch):
+    monkeypatch.setattr(utils, "abbr_pattern_cache_size", 2)
+    for abbr in ["NSW", "WA", "QLD"]:
+        get_abbr_patterns(abbr)
+    assert get_abbr_cache(compile_abbr_patterns).cache_info().currsize == 2
+    monkeypatch.setattr(utils, "abbr_pattern_cache_size", 16)
+    for abbr in ["NSW", "WA", "QLD"]:
+        get_abbr_patterns(abbr)
+    assert get_abbr_cache(compile_abbr_patterns).cache_info().maxsize == 16
+    assert get_abbr_cache(compile_abbr_patterns).cache_info().currsize == 3
@@ -0,0 +1,52 @@
+import random
+import re
+
+from lib.utils import normalize_values, split_number_text, split_number_text_batch, not_allowed_chars, \
+    value_separator
+
+__author__ = 'minh'
+
+alphabet = ["1", "2", "9", "0", ".", "e", "E", "a", "Z", " ", "-", "/", "*", "?", '"', "<", "|", "\t", "é", "北",
+            value_separator]
+
+
+def normalize_value(value):
+    # the cleaning of a single value by Column.add_value before the values were added in batches
+    if not value:
+        return None
+    value = value.strip()
+    if not value or value == "NULL":
+        return None
+    return re.sub(not_allowed_chars, " ", value.encode("ascii", "ignore").decode())
+
+
+def get_values(rng, count, with_separator):
+    letters = alphabet if with_separator else alphabet[:-1]
+    values = ["".join([rng.choice(letters) for _ in range(rng.randint(0, 12))]) for _ in range(count)]
+    return values + ["", "NULL", " NULL ", "  ", "12", "3.5e10", "1.2.3", "x1y22z333"]
+
+
+def test_normalize_values_matches_single_values():
+    rng = random.Random(0)
+    for with_separator in [False, True]:
+        for _ in range(50):
+            values = get_values(rng, rng.randint(0, 40), with_separator)
+            expected = [normalize_value(value) for value in values]
+            assert normalize_values(values) == [value for value in expected if value is not None]
+
+
+def test_split_number_text_batch_matches_single_values():
+    rng = random.Random(1)
+    for with_separator in [False, True]:
+        for _ in range(50):
+            values = normalize_values(get_values(rng, rng.randint(0, 40), with_separator))
+            if with_separator:
+                values.append("4" + value_separator + "2")
+            texts, numbers = split_number_text_batch(values)
+            expected_numbers = []
+            for idx, value in enumerate(values):
+                value_numbers, text = split_number_text(value)
+                assert texts[idx] == text
+                if value_numbers:
+                    expected_numbers.append((idx, max([float(number[0]) for number in value_numbers])))
+            assert numbers == expected_numbers
@@ -1,18 +1,29 @@
+from functools import lru_cache
+import math
 import re
+import unicodedata
+import zlib
 
+import numpy as np
 from numpy import median
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
+from lib import utils
 from tests import balance_result
 from tests.label import jaccard_similarity
 
 __author__ = 'alse'
 
+# the unicode separators of \p{Z}, which re does not support: the whitespace that is not a control character
+separator_class = r"[^\S\t\n\r\f\v\x1c-\x1f\x85]"
+# prime modulus of the hash functions of the minhash sketches, above the 32 bits of crc32
+minhash_prime = 4294967311
+
 
 def word2vec_cosine_test(train_vec, test_vec):
     if len(train_vec) == 0 or len(test_vec) == 0:
         return 0
+    # sklearn is imported on use to keep the import of the feature tests fast
+    from sklearn.metrics.pairwise import cosine_similarity
     return cosine_similarity(train_vec, test_vec)
 
 
@@ -21,9 +32,66 @@ def jaccard_test(train_examples, test_examples, num1, num2):
     return balance_result(num1, num2, False, result)
 
 
+def get_minhash_parameters(size):
+    """
+    Parameters a, b of the hash functions (a * h + b) mod minhash_prime of the sketches,
+    derived from the position of the function so that a sketch of any size starts with the same functions.
+    """
+    a = [zlib.crc32("a{}".format(idx).encode("utf-8")) % 2 ** 31 | 1 for idx in range(size)]
+    b = [zlib.crc32("b{}".format(idx).encode("utf-8")) for idx in range(size)]
+    return np.array(a, dtype=np.uint64), np.array(b, dtype=np.uint64)
+
+
+def get_minhash(values, size=None):
+    """
+    MinHash sketch of a set of values: the minimum of every hash function over the values.
+    The sketch of a union is the element-wise minimum of the sketches.
+    :param size: Number of hash functions. Defaults to utils.minhash_size.
+    :return: List of size hashes, empty if there are no values or sketches are disabled.
+    """
+    size = size or utils.minhash_size
+    if not values or not size:
+        return []
+    a, b = get_minhash_parameters(size)
+    hashes = np.array([zlib.crc32(value.encode("utf-8")) for value in set(values)], dtype=np.uint64)
+    sketch = np.full(size, minhash_prime, dtype=np.uint64)
+    # a * h stays below 2 ** 63, rows are chunked to bound the memory of the hash matrix
+    chunk = max(1, 2 ** 22 // size)
+    for first in range(0, len(hashes), chunk):
+        matrix = (np.outer(hashes[first:first + chunk], a) + b) % minhash_prime
+        sketch = np.minimum(sketch, matrix.min(axis=0))
+    return sketch.tolist()
+
+
+def merge_minhash(sketch1, sketch2):
+    if not sketch1 or not sketch2:
+        return list(sketch1 or sketch2)
+    return [min(hash1, hash2) for hash1, hash2 in zip(sketch1, sketch2)]
+
+
+def get_minhash_size(error):
+    """
+    Hash functions for which the estimate of a jaccard similarity is within error of it with 95% probability:
+    the standard deviation of the estimate is at most 1 / (2 * sqrt(size)).
+    """
+    return int(math.ceil(1.0 / error ** 2))
+
+
+def minhash_jaccard_test(train_sketch, test_sketch, num1, num2):
+    """
+    Approximate jaccard_test on the sketches of the textual sets, within utils.jaccard_error.
+    """
+    if not train_sketch or not test_sketch:
+        return 0
+    size = min(get_minhash_size(utils.jaccard_error), len(train_sketch), len(test_sketch))
+    result = np.mean(np.equal(train_sketch[:size], test_sketch[:size]))
+    return balance_result(num1, num2, False, float(result))
+
+
 def cosine_test(train_text, test_text, num1, num2):
     if not train_text or not test_text:
         return 0.0
+    from sklearn.feature_extraction.text import TfidfVectorizer
     tfidf_vectorizer = TfidfVectorizer()
     tfidf_matrix = tfidf_vectorizer.fit_transform([train_text.lower(), test_text.lower()])
     result = (tfidf_matrix * tfidf_matrix.T).A[0, 1]
@@ -48,61 +116,105 @@ def len_test(train_lengths, test_lengths, num1, num2):
         return avg_test_length == avg_train_length
 
 
-def get_abbr_patterns(abbr):
+def get_abbr_regexes(abbr):
     if not abbr or len(abbr) > 5:
         return []
 
-    abbr = re.sub(r'\p{P}', "", abbr)
+    # drop the punctuation of \p{P}
+    abbr = "".join([char for char in abbr if not unicodedata.category(char).startswith("P")])
+    if not abbr:
+        return []
+    chars = [re.escape(char) for char in abbr]
     patterns = [r"\b"] * 4
-    for char in abbr[:-1]:
-        patterns[0] += (char + r"[a-z]+\p{Z}+")
+    for char in chars[:-1]:
+        patterns[0] += (char + r"[a-z]+" + separator_class + "+")
         patterns[1] += (char + r"[a-z]*")
-        patterns[2] += (char + r"[a-z]*?\p{Z}")
-    patterns[0] += (abbr[-1] + r"[a-z]+\b")
-    patterns[1] += (abbr[-1] + r"[a-z]*\b")
-    patterns[2] += (abbr[-1] + r"[a-z]*\b")
-    patterns[3] += (abbr + r"[a-z]+\b")
-
-    for idx, pattern in enumerate(patterns):
-        try:
-            patterns[idx] = re.compile(pattern, re.IGNORECASE)
-        except Exception:
-            patterns[idx] = re.compile("", re.IGNORECASE)
-
+        patterns[2] += (char + r"[a-z]*?" + separator_class)
+    patterns[0] += (chars[-1] + r"[a-z]+\b")
+    patterns[1] += (chars[-1] + r"[a-z]*\b")
+    patterns[2] += (chars[-1] + r"[a-z]*\b")
+    patterns[3] += ("".join(chars) + r"[a-z]+\b")
     return patterns
 
 
-def abbr_test(train_examples, test_examples, num1, num2):
-    # if testExamples is a string, perform metadata abbr test (label thing). Else do the normal one
-    train_example_set = set(train_examples)
+# (cache size, cached function) of the functions compiling abbreviations, by function
+abbr_caches = {}
+
+
+def get_abbr_cache(compile_abbr):
+    """
+    :param compile_abbr: Function compiling the patterns of an abbreviation.
+    :return: compile_abbr cached in an LRU cache of utils.abbr_pattern_cache_size entries, rebuilt when the setting
+    changes.
+    """
+    cache_size = utils.abbr_pattern_cache_size
+    cache = abbr_caches.get(compile_abbr)
+    if cache is None or cache[0] != cache_size:
+        cache = (cache_size, lru_cache(maxsize=cache_size)(compile_abbr))
+        abbr_caches[compile_abbr] = cache
+    return cache[1]
+
+
+def compile_abbr_patterns(abbr):
+    return tuple([re.compile(pattern, re.IGNORECASE) for pattern in get_abbr_regexes(abbr)])
+
 
-    count_matches = 0
+def compile_abbr_matcher(abbr):
+    patterns = get_abbr_regexes(abbr)
+    if not patterns:
+        return None
+    return re.compile("^(?:" + "|".join(patterns) + ")", re.IGNORECASE | re.MULTILINE)
 
+
+def get_abbr_patterns(abbr):
+    return get_abbr_cache(compile_abbr_patterns)(abbr)
+
+
+def get_abbr_matcher(abbr):
+    """
+    One pattern matching the abbreviation at the start of any line, for the values of a column joined by newlines.
+    :return: Compiled pattern, None if abbr can not be an abbreviation.
+    """
+    return get_abbr_cache(compile_abbr_matcher)(abbr)
+
+
+def join_abbr_values(values):
+    """
+    :return: (values joined by newlines, values that contain newlines themselves and are matched one by one)
+    """
+    lines = [value for value in values if "\n" not in value]
+    return "\n".join(lines), [value for value in values if "\n" in value]
+
+
+def match_abbr(abbr, joined_values, other_values=()):
+    """
+    Whether abbr abbreviates any value, with the values joined by join_abbr_values.
+    """
+    matcher = get_abbr_matcher(abbr)
+    if matcher is None:
+        return False
+    if matcher.search(joined_values):
+        return True
+    return any([pattern.match(value) for value in other_values for pattern in get_abbr_patterns(abbr)])
+
+
+def abbr_test(train_examples, test_examples, num1, num2):
+    # if testExamples is a string, perform metadata abbr test (label thing). Else do the normal one
     if isinstance(test_examples, str):
-        patterns = get_abbr_patterns(test_examples)
-        for pattern in patterns:
+        for pattern in get_abbr_patterns(test_examples):
             if pattern.match(train_examples):
-                count_matches += 1
-                break
-        return count_matches
+                return 1
+        return 0
     else:
+        train_example_set = set(train_examples)
         test_example_set = set(test_examples)
 
         if len(test_example_set) > 50 or len(train_example_set) > 50:
             return 0.0
 
-        for test_example in test_example_set:
-            if not test_example.isupper():
-                continue
-            patterns = get_abbr_patterns(test_example)
-            found = False
-            for pattern in patterns:
-                for train_example in train_example_set:
-                    if pattern.match(train_example):
-                        count_matches += 1
-                        found = True
-                        break
-                    if found:
-                        break
+        joined_values, other_values = join_abbr_values(train_example_set)
+        # every test value counts once, whichever of its patterns matches
+        count_matches = len([test_example for test_example in test_example_set
+                             if test_example.isupper() and match_abbr(test_example, joined_values, other_values)])
         result = count_matches * 2.0 / (len(train_example_set) + len(test_example_set))
         return balance_result(num1, num2, False, result)